@@ -9,7 +9,7 @@ from django.dispatch import Signal
 from . import serializer
 from .schemas import ModelAction
 from .settings import AUTO_BROADCAST
-from .utils import send_to
+from .utils import broadcast_mutation
 
 __all__ = []
 
@@ -42,12 +42,20 @@ def receiver(signal: Signal, *, is_active: bool):
     or AUTO_BROADCAST.model_pk
     or AUTO_BROADCAST.related,
 )
-def broadcast_post_save(sender, instance, created=False, **kwargs):
+def broadcast_post_save(
+    sender, instance, created=False, update_fields=None, **kwargs
+):
     name = sender._meta.model_name
-    encoded_instance = serializer.encode(instance)
+    key = key_of(instance)
+    if AUTO_BROADCAST.update_fields_only and update_fields is not None:
+        encoded_instance = serializer.encode(instance, update_fields)
+        # don't replace other partial updates of the instance
+        key = (*key, update_fields)
+    else:
+        encoded_instance = serializer.encode(instance)
     action = ModelAction.CREATED if created else ModelAction.UPDATED
     if AUTO_BROADCAST.model:
-        notify_mutation([name], action, encoded_instance)
+        notify_mutation([name], action, encoded_instance, key)
 
     if instance.pk is not None:
         if AUTO_BROADCAST.model_pk:
@@ -55,6 +63,7 @@ def broadcast_post_save(sender, instance, created=False, **kwargs):
                 [f"{name}.{instance.pk}"],
                 action,
                 encoded_instance,
+                key,
             )
         if AUTO_BROADCAST.related:
             broadcast_related(
@@ -62,6 +71,7 @@ def broadcast_post_save(sender, instance, created=False, **kwargs):
                 action,
                 instance,
                 encoded_instance,
+                key,
             )
 
 
@@ -74,8 +84,9 @@ def broadcast_post_save(sender, instance, created=False, **kwargs):
 def broadcast_pre_delete(sender, instance, **kwargs):
     name = sender._meta.model_name
     encoded_instance = serializer.encode(instance)
+    key = key_of(instance)
     if AUTO_BROADCAST.model:
-        notify_mutation([name], ModelAction.DELETED, encoded_instance)
+        notify_mutation([name], ModelAction.DELETED, encoded_instance, key)
 
     if instance.pk is not None:
         if AUTO_BROADCAST.model_pk:
@@ -83,6 +94,7 @@ def broadcast_pre_delete(sender, instance, **kwargs):
                 [f"{name}.{instance.pk}"],
                 ModelAction.DELETED,
                 encoded_instance,
+                key,
             )
         if AUTO_BROADCAST.related:
             broadcast_related(
@@ -90,10 +102,13 @@ def broadcast_pre_delete(sender, instance, **kwargs):
                 ModelAction.DELETED,
                 instance,
                 encoded_instance,
+                key,
             )
 
 
-def broadcast_related(sender, action: ModelAction, instance, encoded_instance):
+def broadcast_related(
+    sender, action: ModelAction, instance, encoded_instance, key
+):
     for field in get_related_fields(sender):
         if field["is_m2m"]:
             fk_ids = getattr(instance, field["name"]).values_list(
@@ -107,7 +122,7 @@ def broadcast_related(sender, action: ModelAction, instance, encoded_instance):
                 f'{field["related_model_name"]}.{fk_id}.{field["related_name"]}'
                 for fk_id in fk_ids
             ]
-            notify_mutation(group_names, action, encoded_instance)
+            notify_mutation(group_names, action, encoded_instance, key)
 
 
 MODEL_RELATED_FIELDS = {}
@@ -139,6 +154,7 @@ def get_related_fields(model):
 def broadcast_m2m_changed(sender, instance, action, model, pk_set, **kwargs):
     if action.startswith("post_") and instance.pk:
         encoded_instance = serializer.encode(instance)
+        key = key_of(instance)
         if action.endswith("_add"):
             action = ModelAction.ADDED
         elif action.endswith("_remove"):
@@ -151,7 +167,7 @@ def broadcast_m2m_changed(sender, instance, action, model, pk_set, **kwargs):
         model_name = model._meta.model_name
         attr_name = get_name_of(sender, model)
         updates = [f"{model_name}.{pk}.{attr_name}" for pk in pk_set or []]
-        notify_mutation(updates, action, encoded_instance)
+        notify_mutation(updates, action, encoded_instance, key)
 
         model = type(instance)
         model_name = model._meta.model_name
@@ -161,6 +177,7 @@ def broadcast_m2m_changed(sender, instance, action, model, pk_set, **kwargs):
             [f"{update}.{pk}" for pk in pk_set or []],
             action,
             encoded_instance,
+            key,
         )
 
 
@@ -173,7 +190,16 @@ def get_name_of(through, model):
             return model_field.name
 
 
-def notify_mutation(names: t.Iterable[str], action: ModelAction, instance: str):
+def notify_mutation(
+    names: t.Iterable[str],
+    action: ModelAction,
+    instance: str,
+    instance_key: t.Hashable,
+):
     for name in (n.replace("_", "-") for n in names):
         log.debug(f"<-> {action} {name}")
-        send_to(name, "model_mutation", action=action, instance=instance)
+        broadcast_mutation(name, action, instance, instance_key)
+
+
+def key_of(instance: models.Model) -> t.Hashable:
+    return (instance._meta.label_lower, instance.pk)
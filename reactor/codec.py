@@ -0,0 +1,63 @@
+import json
+import typing as t
+
+from . import settings
+
+__all__ = ("Codec", "CODECS", "get_codec", "dumps", "loads")
+
+
+class Codec(t.NamedTuple):
+    """JSON encoder and decoder
+
+    `dumps(obj, default=None)` returns a `str`, `default` is called with the
+    objects the codec can't serialize, like in `json.dumps`.
+    """
+
+    dumps: t.Callable[..., str]
+    loads: t.Callable[[str | bytes], t.Any]
+
+
+def _json_dumps(obj: t.Any, default: t.Callable | None = None) -> str:
+    return json.dumps(obj, default=default)
+
+
+CODECS: dict[str, Codec] = {"json": Codec(_json_dumps, json.loads)}
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    pass
+else:
+    # renders of slots have int keys; dates and dataclasses go to `default`
+    # like in `json`, so the `json_encoders` of the components apply to them
+    _ORJSON_OPTIONS = (
+        orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+    )
+
+    def _orjson_dumps(obj: t.Any, default: t.Callable | None = None) -> str:
+        return orjson.dumps(
+            obj, default=default, option=_ORJSON_OPTIONS
+        ).decode()
+
+    CODECS["orjson"] = Codec(_orjson_dumps, orjson.loads)
+
+
+def get_codec(name: str) -> Codec:
+    if name == "auto":
+        name = "orjson" if "orjson" in CODECS else "json"
+    elif name == "orjson" and name not in CODECS:
+        raise ImportError(
+            "If you set REACTOR['JSON_CODEC'] to 'orjson' you need to install "
+            "orjson"
+        )
+    if (codec := CODECS.get(name)) is None:
+        raise ValueError(
+            f"Unknown JSON codec {name!r}, use one of: "
+            f"auto, {', '.join(CODECS)}"
+        )
+    return codec
+
+
+dumps, loads = get_codec(settings.JSON_CODEC)
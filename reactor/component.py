@@ -1,7 +1,15 @@
-import difflib
+import logging
+import multiprocessing
 import typing as t
-from asyncio import iscoroutine, iscoroutinefunction
-from functools import reduce
+from asyncio import (
+    gather,
+    get_running_loop,
+    iscoroutine,
+    iscoroutinefunction,
+)
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property
 from uuid import uuid4
 
 from asgiref.sync import async_to_sync
@@ -9,7 +17,12 @@ from channels.layers import BaseChannelLayer
 from django.apps import apps
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import SynchronousOnlyOperation, ValidationError
 from django.db import models
+from django.db.models import Q
+from django.db.models.expressions import Col
+from django.db.models.lookups import Lookup
+from django.db.models.sql.where import WhereNode
 from django.http import HttpRequest
 from django.shortcuts import resolve_url  # type: ignore
 from django.template import loader
@@ -18,8 +31,15 @@ from django.utils.safestring import SafeString, SafeText, mark_safe
 from pydantic import BaseModel, validate_arguments
 from pydantic.fields import Field, ModelField
 
-from . import settings, utils
-from .schemas import DomAction, ModelAction
+from . import codec, metrics, settings, slots, utils
+from .diff import (  # noqa: F401
+    HTMLDiff,
+    KeyedTree,
+    Path,
+    compress_diff,
+    get_engine,
+)
+from .schemas import DomAction, ModelAction, Mutation
 from .utils import db
 
 if settings.USE_HMIN:
@@ -35,11 +55,15 @@ else:
         return html
 
 
-ComponentState = Context = MessagePayload = dict[str, t.Any]
+log = logging.getLogger("reactor")
+
+diff_engine = get_engine(settings.DIFF_ENGINE)
+
+ComponentState = Context = MessagePayload = RenderPayload = dict[str, t.Any]
 RedirectDestination = t.Callable[(...), t.Any] | models.Model | str
-HTMLDiff = list[str | int]
 ComponentOrHtml = t.Union["Component", SafeString]
 P = t.ParamSpec("P")
+T = t.TypeVar("T")
 
 
 class Template(t.Protocol):
@@ -65,13 +89,65 @@ ScrollPosition = (
 
 __all__ = ("Component", "broadcast")
 
+# Components with `_async_render` that turned out to access the database
+# synchronously while rendering, they are rendered in a thread instead
+SYNC_RENDERED: set[t.Type["Component"]] = set()
+
 
 def broadcast(channel: str, **kwargs: t.Any):
     utils.send_to(channel, type="notification", kwargs=kwargs)
 
 
+RenderExecutor = t.Literal["thread", "process"] | None
+_process_pool: ProcessPoolExecutor | None = None
+
+
+async def run_in_executor(
+    executor: RenderExecutor, f: t.Callable[..., T], *args: t.Any
+) -> T:
+    """Runs `f` in the executor `Component._render_executor` names
+
+    `None` runs it right here, `"thread"` in the default executor of the
+    event loop and `"process"` in a pool of `RENDER_PROCESSES` processes,
+    so `f` and its arguments have to be picklable.
+    """
+    global _process_pool
+    if executor is None:
+        return f(*args)
+    elif executor == "process":
+        if _process_pool is None:
+            # forking a process with running threads is not safe
+            _process_pool = ProcessPoolExecutor(
+                settings.RENDER_PROCESSES or None,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        pool = _process_pool
+    else:
+        pool = None
+    return await get_running_loop().run_in_executor(pool, f, *args)
+
+
 class ReactorMeta:
-    _last_sent_html: list[str]
+    # there is one per live component, so it keeps its memory to the minimum
+    __slots__ = (
+        "params",
+        "channel_name",
+        "channel_layer",
+        "_is_frozen",
+        "_redirected_to",
+        "_last_sent_html",
+        "_last_sent_tree",
+        "_last_sent_statics",
+        "_last_sent_slots",
+        "_skip_render",
+    )
+
+    # the html is kept as a single string and split in tokens when diffing,
+    # the list of tokens takes several times its size
+    _last_sent_html: str
+    _last_sent_tree: dict[Path, tuple[int, int]]
+    _last_sent_statics: list[str] | None
+    _last_sent_slots: list[str]
 
     def __init__(
         self,
@@ -84,7 +160,10 @@ class ReactorMeta:
         self.channel_layer = channel_layer
         self._is_frozen: bool = False
         self._redirected_to: str | None = None
-        self._last_sent_html: list[str] = []
+        self._last_sent_html: str = ""
+        self._last_sent_tree: dict[Path, tuple[int, int]] = {}
+        self._last_sent_statics: list[str] | None = None
+        self._last_sent_slots: list[str] = []
         self._skip_render: bool = False
 
     def clone(self):
@@ -97,9 +176,17 @@ class ReactorMeta:
     def skip_render(self):
         self._skip_render = True
 
+    def consume_skip_render(self) -> bool:
+        """Returns if the next render was skipped and clears the flag"""
+        skipped, self._skip_render = self._skip_render, False
+        return skipped
+
     def force_render(self):
         self._skip_render = False
-        self._last_sent_html = []
+        self._last_sent_html = ""
+        self._last_sent_tree = {}
+        self._last_sent_statics = None
+        self._last_sent_slots = []
 
     async def destroy(self, component_id: str):
         self.freeze()
@@ -125,31 +212,147 @@ class ReactorMeta:
 
     async def render_diff(
         self, component: "Component", repo: Repo
-    ) -> HTMLDiff | None:
+    ) -> RenderPayload | None:
+        with metrics.timed(component._name, "render"):
+            return await self._render_and_diff(component, repo)
+
+    async def _render_and_diff(
+        self, component: "Component", repo: Repo
+    ) -> RenderPayload | None:
         if self._skip_render:
             self._skip_render = False
+        elif component._diff_mode == "slots" and (
+            template := slots.compile_template(component._get_template())
+        ):
+            rendered = await self._render_using(
+                self.render_slots, component, repo, template
+            )
+            if rendered is not None:
+                with metrics.timed(component._name, "diff"):
+                    return self._slots_diff(template.statics, rendered)
         else:
-            html = await db(self.render)(component, repo)
-            if html and self._last_sent_html != (html := html.split(" ")):
-                if settings.USE_HTML_DIFF:
-                    diff: HTMLDiff = []
-                    for x in difflib.ndiff(self._last_sent_html, html):
-                        indicator = x[0]
-                        if indicator == " ":
-                            diff.append(1)
-                        elif indicator == "+":
-                            diff.append(x[2:])
-                        elif indicator == "-":
-                            diff.append(-1)
-
-                    if diff:
-                        diff = reduce(compress_diff, diff[1:], diff[:1])
-                else:
-                    diff = html  # type: ignore
-                self._last_sent_html = html
-                return diff
-
-    def render(self, component: "Component", repo: Repo) -> None | SafeText:
+            html = await self._render_using(self.render, component, repo)
+            if html:
+                with metrics.timed(component._name, "diff"):
+                    if component._diff_mode == "keyed":
+                        return self._keyed_diff(html)
+                    else:
+                        return await self._tokens_diff(
+                            html, component._render_executor
+                        )
+
+    async def _render_using(
+        self,
+        render: t.Callable[..., t.Any],
+        component: "Component",
+        repo: Repo,
+        *args: t.Any,
+    ):
+        """Calls `render` in the event loop if the component allows it
+
+        With `_async_render` the async properties are awaited, the querysets
+        they return are fetched and then the template is rendered without
+        leaving the event loop. If the template still access the database
+        synchronously, the component is rendered in a thread from then on.
+        """
+        if not component._async_render or type(component) in SYNC_RENDERED:
+            return await db(render)(component, repo, *args)
+
+        prefetched = await self._prefetch(component)
+        try:
+            return render(component, repo, *args, prefetched=prefetched)
+        except SynchronousOnlyOperation:
+            log.warning(
+                f"{component._name} has `_async_render` but accesses the "
+                "database synchronously during render, rendering it in a "
+                "thread instead"
+            )
+            SYNC_RENDERED.add(type(component))
+            return await db(render)(
+                component, repo, *args, prefetched=prefetched
+            )
+
+    async def _prefetch(self, component: "Component") -> Context:
+        names = list(component._async_properties)
+        values = await gather(*(getattr(component, name) for name in names))
+        prefetched = dict(zip(names, values))
+        for name in component._context_attributes:
+            value = getattr(component, name)
+            if isinstance(value, models.QuerySet):
+                # don't fill the cache of the queryset stored in the state
+                prefetched[name] = value.all()
+
+        for value in prefetched.values():
+            if isinstance(value, models.QuerySet):
+                # async iteration fills the result cache of the queryset
+                async for _ in value:
+                    pass
+        return prefetched
+
+    async def _tokens_diff(
+        self, html: str, executor: RenderExecutor = None
+    ) -> RenderPayload | None:
+        if self._last_sent_html != html:
+            tokens = html.split(" ")
+            if settings.USE_HTML_DIFF:
+                last_sent = self._last_sent_html
+                diff = await run_in_executor(
+                    executor,
+                    diff_engine,
+                    last_sent.split(" ") if last_sent else [],
+                    tokens,
+                )
+            else:
+                diff = tokens
+            self._last_sent_html = html
+            return {"diff": diff}
+
+    def _keyed_diff(self, html: str) -> RenderPayload | None:
+        tree = KeyedTree(html)
+        patches, attributes = tree.diff(self._last_sent_tree)
+        if patches or attributes:
+            self._last_sent_tree = tree.hashes
+            return {"patches": patches, "attributes": attributes}
+
+    def _slots_diff(
+        self, statics: list[str], rendered: list[str]
+    ) -> RenderPayload | None:
+        if statics != self._last_sent_statics:
+            # first render or the template changed (when DEBUG=True)
+            self._last_sent_statics = statics
+            self._last_sent_slots = rendered
+            return {"statics": statics, "slots": rendered}
+
+        changed = {
+            index: value
+            for index, (old, value) in enumerate(
+                zip(self._last_sent_slots, rendered)
+            )
+            if old != value
+        }
+        if changed:
+            self._last_sent_slots = rendered
+            return {"slots": changed}
+
+    def render_slots(
+        self,
+        component: "Component",
+        repo: Repo,
+        template: slots.SlottedTemplate,
+        prefetched: Context | None = None,
+    ) -> list[str] | None:
+        if not (self._is_frozen or self._redirected_to):
+            with metrics.timed(component._name, "context"):
+                context = self._get_context(component, repo, prefetched)
+            with metrics.timed(component._name, "template"):
+                return template.render(context)
+
+    def render(
+        self,
+        component: "Component",
+        repo: Repo,
+        prefetched: Context | None = None,
+    ) -> None | SafeText:
         html = None
         if not self.channel_name and self._redirected_to:
             html = format_html(
@@ -158,9 +361,11 @@ class ReactorMeta:
             )
         elif not (self._is_frozen or self._redirected_to) and html is None:
             template = component._get_template()
-            context = self._get_context(component, repo)
-            html = template.render(context).strip()
-            html = html_minify(html)
+            with metrics.timed(component._name, "context"):
+                context = self._get_context(component, repo, prefetched)
+            with metrics.timed(component._name, "template"):
+                html = template.render(context).strip()
+                html = html_minify(html)
         if html:
             return mark_safe(html)
 
@@ -223,33 +428,55 @@ class ReactorMeta:
         self,
         component: "Component",
         repo: Repo,
+        prefetched: Context | None = None,
     ) -> Context:
-        context = {}
-
-        for attr_name in dir(component):
-            if not attr_name.startswith("_"):
-                attr = getattr(component, attr_name)
-                if not callable(attr):
-                    if iscoroutine(attr) or iscoroutinefunction(attr):
-                        attr = async_to_sync(attr)
-                    context[attr_name] = attr
+        context: Context = {}
+
+        for attr_name in component._context_attributes:
+            attr = getattr(component, attr_name)
+            if not callable(attr):
+                context[attr_name] = attr
+
+        for attr_name in component._context_properties:
+            context[attr_name] = LazyAttribute(component, attr_name)
+
         return dict(
             context,
+            **(prefetched or {}),
             this=component,
             reactor_repository=repo,
         )
 
 
-def compress_diff(diff: HTMLDiff, diff_item: str | int) -> HTMLDiff:
-    if isinstance(diff_item, str) or isinstance(diff[-1], str):
-        diff.append(diff_item)
-    else:
-        same_sign = not (diff[-1] > 0) ^ (diff_item > 0)
-        if same_sign:
-            diff[-1] += diff_item
-        else:
-            diff.append(diff_item)
-    return diff
+class LazyAttribute:
+    """A property of a component that is only evaluated if the template uses it
+
+    Django templates call the callables they find in the context, so this
+    gets evaluated when the template looks it up. The value is kept for the
+    rest of the render, every lookup gets the same object (e.g. the same
+    queryset, fetched once).
+    """
+
+    __slots__ = ("component", "name", "value")
+
+    def __init__(self, component: "Component", name: str):
+        self.component = component
+        self.name = name
+
+    def __call__(self) -> t.Any:
+        try:
+            return self.value
+        except AttributeError:
+            pass
+        value = getattr(self.component, self.name)
+        if iscoroutine(value):
+            value = async_to_sync(_await)(value)
+        self.value = value
+        return value
+
+
+async def _await(awaitable: t.Awaitable[t.Any]) -> t.Any:
+    return await awaitable
 
 
 def load_model_instance(model, v, fields, field: ModelField, config):
@@ -259,13 +486,166 @@ def load_model_instance(model, v, fields, field: ModelField, config):
         return field.type_.objects.filter(pk=v).first()
 
 
+def dump_queryset(qs: models.QuerySet) -> dict[str, t.Any]:
+    """Describes `qs` in JSON, without evaluating it if possible
+
+    Filters on the fields of the model itself with plain values, ordering
+    and slicing are described. Any other query is evaluated and described by
+    the primary keys of its results.
+    """
+    description = {
+        "app": qs.model._meta.app_label,
+        "model": qs.model._meta.model_name,  # type: ignore
+    }
+    try:
+        return description | _describe_query(qs.query)
+    except _Undescribable:
+        return description | {
+            "ids": [_plain(pk) for pk in qs.values_list("pk", flat=True)]
+        }
+
+
+class _Undescribable(Exception):
+    pass
+
+
+JSON_VALUES = (str, int, float, bool, type(None))
+
+
+def _plain(value: t.Any) -> t.Any:
+    return value if isinstance(value, JSON_VALUES) else str(value)
+
+
+def _describe_query(query) -> dict[str, t.Any]:
+    if (
+        query.annotations
+        or query.extra
+        or query.extra_tables
+        or query.combinator
+        or query.distinct_fields
+        or query.values_select
+        or query.group_by is not None
+        or query.select_for_update
+        or query.deferred_loading != (frozenset(), True)
+    ):
+        raise _Undescribable
+    if any(not isinstance(order, str) for order in query.order_by):
+        raise _Undescribable
+    return {
+        # the first alias of the query is the table of the model
+        "where": _describe_where(query.where, query.model._meta.db_table),
+        "order_by": list(query.order_by),
+        "default_ordering": query.default_ordering,
+        "reverse": not query.standard_ordering,
+        "distinct": query.distinct,
+        "low": query.low_mark,
+        "high": query.high_mark,
+    }
+
+
+def _describe_where(node: WhereNode, table: str) -> dict[str, t.Any]:
+    children = []
+    for child in node.children:
+        if isinstance(child, WhereNode):
+            children.append(_describe_where(child, table))
+        elif (
+            isinstance(child, Lookup)
+            and isinstance(child.lhs, Col)
+            and child.lhs.alias == table
+        ):
+            # model instances are already reduced to their primary key
+            many = isinstance(child.rhs, (list, tuple, set))
+            values = list(child.rhs) if many else [child.rhs]
+            if any(hasattr(v, "resolve_expression") for v in values):
+                raise _Undescribable  # F(), subqueries...
+            # values like dates or UUIDs are sent as text and parsed back
+            parse = not all(isinstance(v, JSON_VALUES) for v in values)
+            values = [_plain(v) for v in values]
+            children.append(
+                {
+                    "field": child.lhs.target.attname,
+                    "lookup": child.lookup_name,
+                    "value": values if many else values[0],
+                    "parse": parse,
+                }
+            )
+        else:
+            raise _Undescribable  # joins, transforms, `none()`, raw SQL...
+    return {
+        "connector": node.connector,
+        "negated": node.negated,
+        "children": children,
+    }
+
+
 def load_queryset(model, v, fields, field: ModelField, config):
     if isinstance(v, field.type_):
         return v
-    else:
-        return apps.get_model(v["app"], v["model"]).objects.filter(  # type: ignore
-            pk__in=v["ids"]
-        )
+
+    model = apps.get_model(v["app"], v["model"])
+    queryset = model.objects.all()  # type: ignore
+    if "ids" in v:
+        return queryset.filter(pk__in=v["ids"])
+    elif "where" not in v:
+        raise ValueError("Unknown queryset description")
+
+    queryset = queryset.filter(_load_where(model, v["where"]))
+    if v["order_by"] or not v["default_ordering"]:
+        queryset = queryset.order_by(*v["order_by"])
+    if v["reverse"]:
+        queryset = queryset.reverse()
+    if v["distinct"]:
+        queryset = queryset.distinct()
+    queryset.query.set_limits(v["low"], v["high"])
+    return queryset
+
+
+def _load_where(model: type[models.Model], node: dict[str, t.Any]) -> Q:
+    children = []
+    for child in node["children"]:
+        if "children" in child:
+            children.append(_load_where(model, child))
+            continue
+        value = child["value"]
+        if child["parse"]:
+            to_python = model._meta.get_field(child["field"]).to_python
+            if isinstance(value, list):
+                value = [to_python(v) for v in value]
+            else:
+                value = to_python(value)
+        children.append(Q(**{f"{child['field']}__{child['lookup']}": value}))
+    return Q(*children, _connector=node["connector"], _negated=node["negated"])
+
+
+def load_model_instances(states: t.Iterable[tuple[str, ComponentState]]):
+    """Replaces in `states` the primary keys of model fields by the instances
+
+    `states` are pairs of component name and state. All the instances of the
+    same model are loaded with one query, instead of a query per field of each
+    component in `load_model_instance`.
+    """
+    pks: defaultdict[type[models.Model], set[t.Any]] = defaultdict(set)
+    loading: list[tuple[ComponentState, str, type[models.Model], t.Any]] = []
+    for name, state in states:
+        if (component_class := Component._all.get(name)) is None:
+            continue
+        for field_name, model in component_class._model_fields.items():
+            value = state.get(field_name)
+            if value is None or isinstance(value, models.Model):
+                continue
+            try:
+                pk = model._meta.pk.to_python(value)  # type: ignore
+            except ValidationError:
+                continue  # let the field validation fail
+            pks[model].add(pk)
+            loading.append((state, field_name, model, pk))
+
+    instances = {
+        model: model.objects.in_bulk(model_pks)
+        for model, model_pks in pks.items()
+    }
+    for state, field_name, model, pk in loading:
+        state[field_name] = instances[model].get(pk)
 
 
 class Component(BaseModel):
@@ -278,24 +658,55 @@ class Component(BaseModel):
     _templates: dict[str, Template] = {}
     _fqn: str
 
+    # public attributes exposed in the template context, the properties are
+    # only evaluated if the template uses them
+    _context_attributes: frozenset[str] = frozenset()
+    _context_properties: frozenset[str] = frozenset()
+    _async_properties: frozenset[str] = frozenset()
+
+    # fields holding a model instance, loaded from its primary key
+    _model_fields: dict[str, type[models.Model]] = {}
+
+    # event handlers of the component by name
+    _handlers: dict[str, utils.Handler] = {}
+
     # fields to exclude from the component state during serialization
     _exclude_fields = {"user", "reactor"}
 
+    # compress the state sent to the front-end in `data-state`, worth it for
+    # components with big states like querysets
+    _compress_state: bool = False
+
     # Subscriptions: you can define here which channels this component is
     # subscribed to
     _subscriptions: set[str] = set()
 
+    # How renders are sent to the front-end:
+    #  - "tokens": a diff of the HTML tokens of the whole component
+    #  - "keyed": the subtrees, rooted at elements with an `id` or `data-key`,
+    #    that changed since the last render
+    #  - "slots": the output of the top level tags and variables of the
+    #    template that changed since the last render
+    _diff_mode: t.Literal["tokens", "keyed", "slots"] = "tokens"
+
+    # Where the "tokens" diff runs, see `run_in_executor`; for big components
+    # "process" keeps the diff from holding the GIL of the event loop
+    _render_executor: RenderExecutor = None
+
+    # Render in the event loop instead of a thread: async properties are
+    # awaited and the querysets they return are fetched before rendering, so
+    # the template should not access the database synchronously
+    _async_render: bool = False
+
     class Config:
         arbitrary_types_allowed = True
         validate_assignment = True
         json_encoders = {
             models.Model: lambda x: x.pk,
-            models.QuerySet: lambda qs: {
-                "app": qs.model._meta.app_label,
-                "model": qs.model._meta.model_name,
-                "ids": [x.pk for x in qs],
-            },
+            models.QuerySet: dump_queryset,
         }
+        json_dumps = codec.dumps
+        json_loads = codec.loads
 
     def __init_subclass__(
         cls: t.Type["Component"], name: str | None = None, public: bool = True
@@ -308,6 +719,7 @@ class Component(BaseModel):
             # Fully qualified name
             cls._fqn = f"{cls.__module__}.{name}"
 
+        handlers = dict(cls._handlers)
         for attr_name in vars(cls):
             attr = getattr(cls, attr_name)
             if (
@@ -322,6 +734,8 @@ class Component(BaseModel):
                         config={"arbitrary_types_allowed": True}
                     )(attr),
                 )
+                handlers[attr_name] = utils.Handler.of(attr)
+        cls._handlers = handlers
 
         # Hook up the Model loaders
         for field in cls.__fields__.values():
@@ -337,6 +751,39 @@ class Component(BaseModel):
                     field.pre_validators = [load_model_instance]
                 elif is_qs:
                     field.pre_validators = [load_queryset]
+        cls._model_fields = {
+            field.name: field.type_
+            for field in cls.__fields__.values()
+            if field.pre_validators == [load_model_instance]
+        }
+
+        # Template context
+        attributes = {
+            name for name in cls.__fields__ if not name.startswith("_")
+        }
+        properties = set()
+        async_properties = set()
+        for attr_name in dir(cls):
+            if not attr_name.startswith("_") and attr_name not in attributes:
+                attr = getattr(cls, attr_name)
+                if isinstance(attr, property):
+                    properties.add(attr_name)
+                    if iscoroutinefunction(attr.fget):
+                        async_properties.add(attr_name)
+                elif isinstance(attr, cached_property):
+                    if iscoroutinefunction(attr.func):
+                        # it would keep the coroutine, that can only be
+                        # awaited once
+                        raise TypeError(
+                            f"{cls.__name__}.{attr_name} can't be an async "
+                            "cached_property, use an async property"
+                        )
+                    properties.add(attr_name)
+                elif not callable(attr):
+                    attributes.add(attr_name)
+        cls._context_attributes = frozenset(attributes)
+        cls._context_properties = frozenset(properties)
+        cls._async_properties = frozenset(async_properties)
 
         super().__init_subclass__()
 
@@ -398,6 +845,17 @@ class Component(BaseModel):
     ):
         ...
 
+    async def mutations(self, channel: str, mutations: list[Mutation]):
+        """Receives the mutations of `channel` that arrived together
+
+        Override it to handle all of them before rendering once, by default
+        each one is sent to `mutation`.
+        """
+        for mutation in mutations:
+            await self.mutation(
+                channel, action=mutation.action, instance=mutation.instance
+            )
+
     async def notification(self, channel: str, **kwargs: t.Any):
         ...
 
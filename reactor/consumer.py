@@ -1,16 +1,19 @@
-import json
+import asyncio
 import logging
 import typing as t
 
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from django.contrib.auth.models import AnonymousUser
-from django.core.signing import Signer
 from django.utils.datastructures import MultiValueDict
 
 from reactor.component import Component
 
-from . import serializer
+from . import codec, metrics, protocol, serializer, settings
+from .diff import TokenDictionary
+from .fanout import get_fanout
 from .repository import ComponentRepository
+from .schemas import Mutation
+from .state import StateExpired, adecode_states
 from .utils import parse_request_data
 
 log = logging.getLogger("reactor")
@@ -26,9 +29,26 @@ class ReactorConsumer(AsyncJsonWebsocketConsumer):
     def user(self):
         return self.scope.get("user") or AnonymousUser()
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = asyncio.Lock()
+        self.pending_renders: dict[str, Component] = {}
+        self.flush_task: asyncio.Task | None = None
+        self.pending_mutations: dict[str, list[Mutation]] = {}
+        self.mutations_task: asyncio.Task | None = None
+        self.hibernate_task: asyncio.Task | None = None
+
     async def connect(self):
-        await super().connect()
-        self.subscriptions = set()
+        offered = self.scope.get("subprotocols") or []
+        if settings.BINARY_PROTOCOL and protocol.BINARY in offered:
+            subprotocol = protocol.BINARY
+        elif protocol.JSON in offered:
+            subprotocol = protocol.JSON
+        else:
+            subprotocol = None
+        await self.accept(subprotocol)
+        self.binary = subprotocol == protocol.BINARY
+        self.tokens = TokenDictionary(settings.TOKEN_DICTIONARY_SIZE)
         self.query_string: str = ""
         self.repo = ComponentRepository(
             is_live=True,
@@ -36,6 +56,30 @@ class ReactorConsumer(AsyncJsonWebsocketConsumer):
             channel_name=self.channel_name,
             channel_layer=self.channel_layer,
         )
+        if settings.HIBERNATE_AFTER:
+            self.hibernate_task = asyncio.create_task(self._hibernate_idle())
+
+    async def disconnect(self, code):
+        for task in (self.flush_task, self.mutations_task, self.hibernate_task):
+            if task is not None:
+                task.cancel()
+        self.flush_task = self.mutations_task = self.hibernate_task = None
+        if settings.LOCAL_FANOUT and self.channel_layer is not None:
+            await get_fanout(self.channel_layer).discard(self)
+        await super().disconnect(code)
+
+    async def dispatch(self, message):
+        # Messages and the flush of the pending renders take turns
+        async with self.lock:
+            await super().dispatch(message)
+
+    @classmethod
+    async def decode_json(cls, text_data):
+        return codec.loads(text_data)
+
+    @classmethod
+    async def encode_json(cls, content):
+        return codec.dumps(content)
 
     # Fronted commands
 
@@ -50,11 +94,21 @@ class ReactorConsumer(AsyncJsonWebsocketConsumer):
         state: str,
         children: dict[str, ChildComponent] | None = None,
     ):
-        signer = Signer()
-        decoded_state: dict[str, t.Any] = json.loads(signer.unsign(state))
+        children = children or {}
+        try:
+            decoded_state, *decoded_children_states = await adecode_states(
+                [state] + [state for _, state in children.values()]
+            )
+        except StateExpired as e:
+            # the page is too old, load it again to get fresh states
+            log.warning(f"<<< JOIN {name} {e}")
+            await self.send_command("reload", {})
+            return
         decoded_children: dict[str, tuple[str, dict[str, t.Any]]] = {
-            id: (name, json.loads(signer.unsign(state)))
-            for id, (name, state) in (children or {}).items()
+            id: (name, child_state)
+            for (id, (name, _)), child_state in zip(
+                children.items(), decoded_children_states
+            )
         }
         log.debug(f"<<< JOIN {name} {decoded_state}")
         try:
@@ -73,6 +127,7 @@ class ReactorConsumer(AsyncJsonWebsocketConsumer):
 
     async def command_leave(self, id):
         log.debug(f"<<< LEAVE {id}")
+        self.pending_renders.pop(id, None)
         self.repo.remove(id)
 
     async def command_query_string(self, qs: str):
@@ -107,6 +162,7 @@ class ReactorConsumer(AsyncJsonWebsocketConsumer):
 
     async def component_send_render(self, id):
         log.debug(f">>> SEND-RENDER {id}")
+        await self.repo.wake([id])
         if component := self.repo.get(id):
             await self.send_render(component)
 
@@ -132,44 +188,155 @@ class ReactorConsumer(AsyncJsonWebsocketConsumer):
     # Incoming messages from subscriptions
 
     async def model_mutation(self, data):
+        # Sent by previous versions, one mutation per message
+        await self.receive_mutations(
+            data["channel"],
+            [
+                Mutation(
+                    action=data["action"],
+                    instance=serializer.decode(data["instance"]),
+                )
+            ],
+        )
+
+    async def model_mutations(self, data):
         # The signature here is coupled to:
-        #   `reactor.auto_broadcast.notify_mutation`
-        await self._dispatch_notifications(
-            "mutation",
+        #   `reactor.utils._MutationBuffer`
+        await self.receive_mutations(
             data["channel"],
-            {
-                "instance": serializer.decode(data["instance"]),
-                "action": data["action"],
-            },
+            [
+                Mutation(
+                    action=mutation["action"],
+                    instance=serializer.decode(mutation["instance"]),
+                )
+                for mutation in data["mutations"]
+            ],
         )
 
     async def notification(self, data):
         # The signature here is coupled to:
         #   `reactor.utils.send_notification`
-        await self._dispatch_notifications(
-            "notification", data["channel"], data["kwargs"]
-        )
-
-    async def _dispatch_notifications(
-        self, receiver: str, channel: str, kwargs: dict[str, t.Any]
-    ):
-        for component in self.repo.components_subscribed_to(channel):
-            await getattr(component, receiver)(channel, **kwargs)
+        if settings.HIBERNATE_AFTER:
+            await self.repo.wake_subscribed_to(data["channel"])
+        for component in self.repo.components_subscribed_to(data["channel"]):
+            with metrics.timed(component._name, "notification"):
+                await component.notification(data["channel"], **data["kwargs"])
+            self.repo.refresh_subscriptions(component)
             await self.send_render(component)
         await self.after_mutation_chores()
 
+    async def receive_mutations(self, channel: str, mutations: list[Mutation]):
+        """Delivers `mutations` to the components subscribed to `channel`
+
+        With a `MUTATION_BATCH_WINDOW` the mutations of the channel are held
+        for that long, so the ones that arrive in the meantime are delivered
+        in the same call to `Component.mutations`.
+        """
+        if settings.MUTATION_BATCH_WINDOW:
+            self.pending_mutations.setdefault(channel, []).extend(mutations)
+            if self.mutations_task is None:
+                self.mutations_task = asyncio.create_task(
+                    self._deliver_mutations_later()
+                )
+        else:
+            await self.deliver_mutations({channel: mutations})
+
+    async def _deliver_mutations_later(self):
+        await asyncio.sleep(settings.MUTATION_BATCH_WINDOW)
+        async with self.lock:
+            self.mutations_task = None
+            pending, self.pending_mutations = self.pending_mutations, {}
+            try:
+                await self.deliver_mutations(pending)
+            except Exception as e:
+                log.exception(e)
+
+    async def deliver_mutations(self, pending: dict[str, list[Mutation]]):
+        for channel, mutations in pending.items():
+            if settings.HIBERNATE_AFTER:
+                await self.repo.wake_subscribed_to(channel)
+            for component in self.repo.components_subscribed_to(channel):
+                with metrics.timed(component._name, "mutation"):
+                    await component.mutations(channel, mutations)
+                self.repo.refresh_subscriptions(component)
+                await self.send_render(component)
+        await self.after_mutation_chores()
+
+    async def _hibernate_idle(self):
+        while True:
+            await asyncio.sleep(settings.HIBERNATE_AFTER)
+            async with self.lock:
+                try:
+                    # the pending renders are of components still in use
+                    self.repo.hibernate_idle(keep=self.pending_renders)
+                except Exception as e:
+                    log.exception(e)
+
     # Reply to front-end
 
     async def send_render(self, component: Component):
-        diff = await component._render_diff(self.repo)
-        if diff is not None:
-            log.debug(f">>> RENDER {component._name} {component.id}")
-            await self.send_command(
-                "render",
-                {"id": component.id, "diff": diff},
-            )
+        """Schedules the render of `component`
+
+        The components are rendered and sent together once per iteration
+        of the event loop (or `RENDER_FLUSH_INTERVAL`), a component marked
+        several times in the meantime is rendered once.
+        """
+        if component.reactor.consume_skip_render():
+            return
+        self.pending_renders[component.id] = component
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(settings.RENDER_FLUSH_INTERVAL)
+        async with self.lock:
+            self.flush_task = None
+            try:
+                await self.flush_renders()
+            except Exception as e:
+                log.exception(e)
+
+    async def flush_renders(self):
+        renders = []
+        names = []
+        while self.pending_renders:
+            pending, self.pending_renders = self.pending_renders, {}
+            for component in pending.values():
+                payload = await component._render_diff(self.repo)
+                if payload is not None:
+                    log.debug(f">>> RENDER {component._name} {component.id}")
+                    renders.append({"id": component.id, **payload})
+                    names.append(component._name)
+        if renders:
+            if self.tokens.size:
+                # only once all of them rendered, the front-end has to get
+                # every token added to the dictionary
+                for render in renders:
+                    if "diff" in render:
+                        render["diff"] = self.tokens.encode(render["diff"])
+            sizes: list[int] = []
+            with metrics.timed("*", "send"):
+                if self.binary:
+                    frame = protocol.encode_renders(renders, sizes)
+                    await self.send(bytes_data=frame)
+                else:
+                    # the renders are encoded one by one to measure them
+                    encoded = [codec.dumps(render) for render in renders]
+                    sizes = [len(render) for render in encoded]
+                    await self.send(
+                        text_data='{"command": "render", "payload": ['
+                        + ", ".join(encoded)
+                        + "]}"
+                    )
+            if settings.METRICS:
+                for name, size in zip(names, sizes):
+                    metrics.record(name, "payload", size)
+            # children joined while rendering can subscribe to channels
+            await self.update_to_which_channels_im_subscribed_to()
 
     async def send_command(self, command, payload):
+        # pending renders go first, commands like `focus_on` expect them
+        await self.flush_renders()
         await self.send_json({"command": command, "payload": payload})
 
     async def after_mutation_chores(self):
@@ -178,21 +345,30 @@ class ReactorConsumer(AsyncJsonWebsocketConsumer):
 
     async def update_to_which_channels_im_subscribed_to(self):
         if self.channel_layer is not None and self.channel_name is not None:
-            subscriptions = self.repo.subscriptions
+            added, removed = self.repo.pop_subscription_changes()
+            fanout = (
+                get_fanout(self.channel_layer)
+                if settings.LOCAL_FANOUT
+                else None
+            )
 
-            # new subscriptions
-            for channel in subscriptions - self.subscriptions:
+            for channel in added:
                 log.debug(f"::: SUBSCRIBE {self.channel_name} to {channel}")
-                await self.channel_layer.group_add(channel, self.channel_name)
-
-            # remove subscriptions
-            for channel in self.subscriptions - subscriptions:
+                if fanout is not None:
+                    await fanout.group_add(channel, self)
+                else:
+                    await self.channel_layer.group_add(
+                        channel, self.channel_name
+                    )
+
+            for channel in removed:
                 log.debug(f"::: UNSUBSCRIBE {self.channel_name} to {channel}")
-                await self.channel_layer.group_discard(
-                    channel, self.channel_name
-                )
-
-            self.subscriptions = subscriptions
+                if fanout is not None:
+                    await fanout.group_discard(channel, self)
+                else:
+                    await self.channel_layer.group_discard(
+                        channel, self.channel_name
+                    )
 
     async def send_query_string(self):
         new_qs = self.repo.get_query_string()
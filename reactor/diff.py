@@ -0,0 +1,470 @@
+import difflib
+import re
+import typing as t
+from functools import reduce
+from html import unescape
+
+from lru import LRU
+
+__all__ = (
+    "HTMLDiff",
+    "compress_diff",
+    "get_engine",
+    "register",
+    "ENGINES",
+    "KeyedTree",
+    "TokenDictionary",
+)
+
+# Run-length encoded diff understood by the front-end:
+#  - positive int: keep that many tokens from the last render
+#  - negative int: skip (delete) that many tokens from the last render
+#  - str: insert this token
+HTMLDiff = list[str | int]
+DiffEngine = t.Callable[[list[str], list[str]], HTMLDiff]
+# A diff where the inserted tokens can be entries of a `TokenDictionary`
+EncodedDiff = list[str | int | list[str | int]]
+
+ENGINES: dict[str, DiffEngine] = {}
+
+# Beyond this amount of edits the Myers engine stops looking for the shortest
+# edit script, the search takes O(D²) and runs in the event loop unless the
+# component has a `_render_executor`. The changed region is then diffed
+# token by token at the same positions, in linear time.
+MAX_EDIT_DISTANCE = 256
+
+
+def register(name: str):
+    def _decorator(f: DiffEngine) -> DiffEngine:
+        ENGINES[name] = f
+        return f
+
+    return _decorator
+
+
+def get_engine(name: str) -> DiffEngine:
+    if (engine := ENGINES.get(name)) is None:
+        raise ValueError(
+            f"Unknown diff engine {name!r}, use one of: {', '.join(ENGINES)}"
+        )
+    return engine
+
+
+def compress_diff(diff: HTMLDiff, diff_item: str | int) -> HTMLDiff:
+    if isinstance(diff_item, str) or isinstance(diff[-1], str):
+        diff.append(diff_item)
+    else:
+        same_sign = not (diff[-1] > 0) ^ (diff_item > 0)
+        if same_sign:
+            diff[-1] += diff_item
+        else:
+            diff.append(diff_item)
+    return diff
+
+
+@register("ndiff")
+def ndiff(old: list[str], new: list[str]) -> HTMLDiff:
+    diff: HTMLDiff = []
+    for x in difflib.ndiff(old, new):
+        indicator = x[0]
+        if indicator == " ":
+            diff.append(1)
+        elif indicator == "+":
+            diff.append(x[2:])
+        elif indicator == "-":
+            diff.append(-1)
+
+    if diff:
+        diff = reduce(compress_diff, diff[1:], diff[:1])
+    return diff
+
+
+@register("myers")
+def myers(old: list[str], new: list[str]) -> HTMLDiff:
+    """Shortest edit script between `old` and `new` (Myers, 1986)
+
+    Common prefix and suffix are trimmed first, the remaining tokens are
+    mapped to integers through a shared table so the O((N+M)·D) search only
+    compares ints. Typical re-renders change a handful of tokens, so this
+    runs in linear time on the size of the component.
+    """
+    n, m = len(old), len(new)
+    prefix = _common_prefix(old, new)
+    suffix = _common_prefix(old[prefix:][::-1], new[prefix:][::-1])
+
+    diff = _Builder()
+    diff.keep(prefix)
+
+    old_middle = old[prefix : n - suffix]
+    new_middle = new[prefix : m - suffix]
+    if not old_middle:
+        diff.insert(new_middle)
+    elif not new_middle:
+        diff.delete(len(old_middle))
+    else:
+        table: dict[str, int] = {}
+        a = [table.setdefault(token, len(table)) for token in old_middle]
+        b = [table.setdefault(token, len(table)) for token in new_middle]
+        script = _shortest_edit(a, b)
+        if script is None:
+            _positional_diff(diff, a, b, new_middle)
+        else:
+            for op, value in script:
+                if op == _KEEP:
+                    diff.keep(value)
+                elif op == _DELETE:
+                    diff.delete(value)
+                else:
+                    diff.insert([new_middle[value]])
+
+    diff.keep(suffix)
+    return diff.items
+
+
+_KEEP, _DELETE, _INSERT = range(3)
+_CHUNK = 256
+
+
+def _positional_diff(
+    diff: "_Builder", a: list[int], b: list[int], new: list[str]
+):
+    # changes in place, like toggling the class of many rows, only send the
+    # changed tokens
+    size = min(len(a), len(b))
+    i = 0
+    while i < size:
+        start = i
+        while i < size and a[i] == b[i]:
+            i += 1
+        diff.keep(i - start)
+        start = i
+        while i < size and a[i] != b[i]:
+            i += 1
+        diff.delete(i - start)
+        diff.insert(new[start:i])
+    diff.delete(len(a) - size)
+    diff.insert(new[size:])
+
+
+def _common_prefix(a: list[str], b: list[str]) -> int:
+    # compare whole chunks first, slice comparison runs in C
+    size = min(len(a), len(b))
+    i = 0
+    while i + _CHUNK <= size and a[i : i + _CHUNK] == b[i : i + _CHUNK]:
+        i += _CHUNK
+    while i < size and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def _shortest_edit(a: list[int], b: list[int]) -> list[tuple[int, int]] | None:
+    """Returns the edit script as a list of `(op, value)`
+
+    For `_KEEP` and `_DELETE` the value is the amount of tokens, for
+    `_INSERT` is the index of the inserted token in `b`. Returns `None` if
+    there are more than `MAX_EDIT_DISTANCE` edits.
+    """
+    n, m = len(a), len(b)
+    if abs(n - m) > MAX_EDIT_DISTANCE:
+        # each token of difference in length is at least one edit
+        return None
+    offset = n + m + 1
+    v = [0] * (2 * offset + 1)
+    trace: list[list[int]] = []
+    for d in range(min(n + m, MAX_EDIT_DISTANCE) + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                trace.append(v[offset - d : offset + d + 1])
+                return _backtrack(trace, n, m)
+        trace.append(v[offset - d : offset + d + 1])
+    return None
+
+
+def _backtrack(trace: list[list[int]], n: int, m: int):
+    script: list[tuple[int, int]] = []
+    x, y = n, m
+    for d in range(len(trace) - 1, 0, -1):
+        previous = trace[d - 1]  # holds diagonals from -(d - 1) to (d - 1)
+        k = x - y
+        if k == -d or (
+            k != d and previous[k - 1 + d - 1] < previous[k + 1 + d - 1]
+        ):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = previous[prev_k + d - 1]
+        prev_y = prev_x - prev_k
+
+        if prev_k == k + 1:
+            # moved down: inserted b[prev_y]
+            snake = x - prev_x
+            if snake:
+                script.append((_KEEP, snake))
+            script.append((_INSERT, prev_y))
+        else:
+            # moved right: deleted a[prev_x]
+            snake = x - prev_x - 1
+            if snake:
+                script.append((_KEEP, snake))
+            script.append((_DELETE, 1))
+        x, y = prev_x, prev_y
+
+    if x:
+        script.append((_KEEP, x))
+    script.reverse()
+    return script
+
+
+class _Builder:
+    def __init__(self):
+        self.items: HTMLDiff = []
+
+    def keep(self, amount: int):
+        if amount:
+            if self.items and _is_int(last := self.items[-1]) and last > 0:
+                self.items[-1] = last + amount
+            else:
+                self.items.append(amount)
+
+    def delete(self, amount: int):
+        if amount:
+            if self.items and _is_int(last := self.items[-1]) and last < 0:
+                self.items[-1] = last - amount
+            else:
+                self.items.append(-amount)
+
+    def insert(self, tokens: list[str]):
+        self.items.extend(tokens)
+
+
+def _is_int(item: str | int) -> t.TypeGuard[int]:
+    return not isinstance(item, str)
+
+
+class TokenDictionary:
+    """Tokens already sent through a connection, to reference them by index
+
+    Components render the same markup and class names over and over, so
+    after a token is sent once the front-end keeps it and the next time it is
+    inserted, in this or any other component, only its index is sent:
+
+     - `["token"]`: insert the token and add it to the dictionary
+     - `[index]`: insert the token number `index` of the dictionary
+
+    The front-end has to process the diffs in the same order they were
+    encoded. Tokens shorter than `min_length` are cheaper to send than their
+    index, and tokens longer than `max_length` (like the signed state of the
+    component) rarely repeat and would take most of the memory. Tokens are
+    only added the second time they are sent, `seen` only keeps the hashes
+    of the tokens sent once, and once the dictionary is full new tokens are
+    sent as they are.
+    """
+
+    def __init__(self, size: int, min_length: int = 6, max_length: int = 256):
+        self.size = size
+        self.min_length = min_length
+        self.max_length = max_length
+        self.indexes: dict[str, int] = {}
+        self.seen: dict[int, None] = LRU(max(size, 1))
+
+    def encode(self, diff: HTMLDiff) -> EncodedDiff:
+        encoded: EncodedDiff = []
+        for item in diff:
+            if (
+                isinstance(item, str)
+                and self.min_length <= len(item) <= self.max_length
+            ):
+                if (index := self.indexes.get(item)) is not None:
+                    encoded.append([index])
+                elif (key := hash(item)) not in self.seen:
+                    self.seen[key] = None
+                    encoded.append(item)
+                elif len(self.indexes) < self.size:
+                    self.indexes[item] = len(self.indexes)
+                    encoded.append([item])
+                else:
+                    encoded.append(item)
+            else:
+                encoded.append(item)
+        return encoded
+
+
+# Keyed diff
+#
+# Instead of diffing the tokens of the whole component, the rendered HTML is
+# split in subtrees rooted at elements with an `id` or a `data-key`. Only the
+# topmost subtrees whose own markup changed are sent, so the front-end only
+# morphs those nodes.
+
+# A path is the list of CSS selectors to go from the component root to a
+# keyed element, the empty path is the component root itself. Each selector
+# matches among the keyed children of the previous step only, not among the
+# elements nested in other keyed elements, so keys can repeat in other lists.
+Path = tuple[str, ...]
+Patch = tuple[Path, str]
+
+VOID_ELEMENTS = {
+    "area",
+    "base",
+    "br",
+    "col",
+    "embed",
+    "hr",
+    "img",
+    "input",
+    "link",
+    "meta",
+    "source",
+    "track",
+    "wbr",
+}
+RAW_TEXT_ELEMENTS = {"script", "style", "textarea"}
+
+_MARKUP = re.compile(
+    r"<!--.*?-->"
+    r"|<(?P<closing>/?)(?P<tag>[a-zA-Z][\w:-]*)"
+    r"(?P<attrs>(?:[^>\"']|\"[^\"]*\"|'[^']*')*)>",
+    re.DOTALL,
+)
+_KEY_ATTR = re.compile(
+    r"(?:^|\s)(?P<name>id|data-key)\s*=\s*"
+    r"(?:\"(?P<dq>[^\"]*)\"|'(?P<sq>[^']*)'|(?P<bare>[^\s\"'>]+))"
+)
+
+
+class KeyedNode:
+    __slots__ = ("path", "start", "tag_end", "end", "children")
+
+    def __init__(self, path: Path, start: int, tag_end: int):
+        self.path = path
+        self.start = start
+        self.tag_end = tag_end
+        self.end = tag_end
+        self.children: list["KeyedNode"] = []
+
+
+class KeyedTree:
+    """Keyed subtrees of a rendered component and the hash of their markup
+
+    Each keyed node has two hashes, one of its start tag and one of its
+    content, so a change in the attributes of a node (like the `data-state`
+    of the component root) does not require to send the whole subtree.
+    """
+
+    def __init__(self, html: str):
+        self.html = html
+        self.root = KeyedNode((), 0, 0)
+        self.root.end = len(html)
+        self._parse()
+        self.hashes: dict[Path, tuple[int, int]] = {}
+        self._hash(self.root)
+
+    def diff(
+        self, previous: dict[Path, tuple[int, int]]
+    ) -> tuple[list[Patch], list[Patch]]:
+        """Patches to go from the tree with `previous` hashes to this one
+
+        Returns the subtrees that have to be replaced and the start tags of
+        the nodes that only changed their attributes.
+        """
+        patches: list[Patch] = []
+        attributes: list[Patch] = []
+        pending = [self.root]
+        while pending:
+            node = pending.pop()
+            tag_hash, content_hash = self.hashes[node.path]
+            previous_tag_hash, previous_content_hash = previous.get(
+                node.path, (None, None)
+            )
+            if previous_content_hash != content_hash:
+                patches.append((node.path, self.html[node.start : node.end]))
+            else:
+                if previous_tag_hash != tag_hash:
+                    attributes.append(
+                        (node.path, self.html[node.start : node.tag_end])
+                    )
+                pending.extend(node.children)
+        return patches, attributes
+
+    def _parse(self):
+        html = self.html
+        # stack of (tag name, keyed node opened by this tag or None)
+        stack: list[tuple[str, KeyedNode | None]] = []
+        parents = [self.root]
+        pos = 0
+        while match := _MARKUP.search(html, pos):
+            pos = match.end()
+            tag = match["tag"]
+            if tag is None:  # comment
+                continue
+            tag = tag.lower()
+            if match["closing"]:
+                while stack:
+                    name, node = stack.pop()
+                    if node is not None:
+                        node.end = match.end()
+                        parents.pop()
+                    if name == tag:
+                        break
+                continue
+
+            node = None
+            if match.start() == 0:
+                # the first tag is the root of the component, already keyed
+                self.root.tag_end = match.end()
+            elif key := _KEY_ATTR.search(match["attrs"]):
+                value = key["dq"] if key["dq"] is not None else key["sq"]
+                if value is None:
+                    value = key["bare"]
+                node = KeyedNode(
+                    parents[-1].path + (_selector(key["name"], value),),
+                    match.start(),
+                    match.end(),
+                )
+                parents[-1].children.append(node)
+
+            if tag in RAW_TEXT_ELEMENTS:
+                closing = re.compile(f"</{tag}", re.IGNORECASE).search(
+                    html, pos
+                )
+                pos = len(html) if closing is None else closing.start()
+            if tag in VOID_ELEMENTS or match["attrs"].rstrip().endswith("/"):
+                continue
+            stack.append((tag, node))
+            if node is not None:
+                parents.append(node)
+
+        # unclosed keyed tags span until the end of the document
+        for _, node in stack:
+            if node is not None:
+                node.end = len(html)
+
+    def _hash(self, node: KeyedNode):
+        # The content of a node is its inner HTML where each keyed child is
+        # replaced by its path, so changes in a child don't change the parent.
+        parts = []
+        cursor = node.tag_end
+        for child in node.children:
+            parts.append(self.html[cursor : child.start])
+            parts.append("\0".join(child.path))
+            cursor = child.end
+            self._hash(child)
+        parts.append(self.html[cursor : node.end])
+        self.hashes[node.path] = (
+            hash(self.html[node.start : node.tag_end]),
+            hash("".join(parts)),
+        )
+
+
+def _selector(attr: str, value: str) -> str:
+    value = unescape(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'[{attr}="{value}"]'
@@ -0,0 +1,111 @@
+"""Fan-out of the group messages to the connections of this process
+
+Instead of adding the channel of each connection to the groups of the
+channel layer, the process adds a single channel of its own and routes the
+messages it receives there to the consumers subscribed to the group. So a
+message to a group reaches each process once instead of once per
+connection.
+
+The messages are routed using their `channel` key, that reactor sets to the
+name of the group.
+
+The channel of the process gets the messages of all the groups, its name
+starts with `CHANNEL_PREFIX` so its capacity can be raised with the
+`channel_capacity` of the channel layer. Channel layers like channels_redis
+drop the members of a group after `group_expiry`, so the channel is added
+again to its groups every quarter of it.
+"""
+
+import asyncio
+import logging
+import typing as t
+
+from channels.layers import BaseChannelLayer
+
+if t.TYPE_CHECKING:
+    from .consumer import ReactorConsumer
+
+__all__ = ("LocalFanout", "get_fanout")
+
+log = logging.getLogger("reactor")
+
+CHANNEL_PREFIX = "reactor.fanout"
+
+
+class LocalFanout:
+    def __init__(self, channel_layer: BaseChannelLayer):
+        self.channel_layer = channel_layer
+        self.channel_name: str | None = None
+        self.groups: dict[str, set["ReactorConsumer"]] = {}
+        self.receiver: asyncio.Task | None = None
+        self.refresher: asyncio.Task | None = None
+        self.refresh_interval: float = (
+            getattr(channel_layer, "group_expiry", 86400) / 4
+        )
+        # keeps a reference to the dispatches, asyncio only keeps weak ones
+        self.dispatches: set[asyncio.Task] = set()
+
+    async def group_add(self, group: str, consumer: "ReactorConsumer"):
+        if self.channel_name is None:
+            self.channel_name = await self.channel_layer.new_channel(
+                CHANNEL_PREFIX
+            )
+        if self.receiver is None:
+            self.receiver = asyncio.create_task(self._receive())
+            self.refresher = asyncio.create_task(self._refresh())
+        if (consumers := self.groups.get(group)) is None:
+            consumers = self.groups[group] = set()
+            await self.channel_layer.group_add(group, self.channel_name)
+        consumers.add(consumer)
+
+    async def group_discard(self, group: str, consumer: "ReactorConsumer"):
+        consumers = self.groups.get(group)
+        if consumers is not None:
+            consumers.discard(consumer)
+            if not consumers:
+                del self.groups[group]
+                await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def discard(self, consumer: "ReactorConsumer"):
+        for group in [g for g, cs in self.groups.items() if consumer in cs]:
+            await self.group_discard(group, consumer)
+
+    async def _receive(self):
+        assert self.channel_name is not None
+        while True:
+            try:
+                message = await self.channel_layer.receive(self.channel_name)
+            except Exception as e:
+                log.exception(e)
+                await asyncio.sleep(1)
+                continue
+            for consumer in self.groups.get(message.get("channel"), ()):
+                task = asyncio.create_task(self._dispatch(consumer, message))
+                self.dispatches.add(task)
+                task.add_done_callback(self.dispatches.discard)
+
+    async def _refresh(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            for group in list(self.groups):
+                try:
+                    await self.channel_layer.group_add(group, self.channel_name)
+                except Exception as e:
+                    log.exception(e)
+
+    async def _dispatch(self, consumer: "ReactorConsumer", message: dict):
+        try:
+            await consumer.dispatch(message)
+        except Exception as e:
+            log.exception(e)
+
+
+_fanouts: dict[BaseChannelLayer, LocalFanout] = {}
+
+
+def get_fanout(channel_layer: BaseChannelLayer) -> LocalFanout:
+    """The fan-out of `channel_layer` in this process"""
+    fanout = _fanouts.get(channel_layer)
+    if fanout is None:
+        fanout = _fanouts[channel_layer] = LocalFanout(channel_layer)
+    return fanout
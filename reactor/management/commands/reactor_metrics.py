@@ -0,0 +1,60 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from reactor import metrics
+
+
+class Command(BaseCommand):
+    help = "Shows the metrics of the components published by the processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--json", action="store_true", help="Dump the histograms as JSON"
+        )
+        parser.add_argument(
+            "--component", help="Only show the metrics of this component"
+        )
+
+    def handle(self, *args, **options):
+        histograms = sorted(
+            (key, histogram)
+            for key, histogram in metrics.published().items()
+            if options["component"] in (None, key[0])
+        )
+        if options["json"]:
+            self.stdout.write(
+                json.dumps(
+                    [
+                        {
+                            "component": component,
+                            "metric": metric,
+                            **histogram.to_dict(),
+                        }
+                        for (component, metric), histogram in histograms
+                    ],
+                    indent=2,
+                )
+            )
+            return
+
+        if not histograms:
+            self.stdout.write(
+                "No metrics published, is REACTOR['METRICS'] enabled?"
+            )
+            return
+
+        self.stdout.write(
+            f"{'component':<24}{'metric':<14}{'count':>8}{'mean':>10}"
+            f"{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}"
+        )
+        for (component, metric), histogram in histograms:
+            self.stdout.write(
+                f"{component:<24}{metric:<14}{histogram.count:>8}"
+                f"{histogram.sum / histogram.count:>10.1f}"
+                f"{histogram.percentile(50):>10.1f}"
+                f"{histogram.percentile(90):>10.1f}"
+                f"{histogram.percentile(99):>10.1f}"
+                f"{histogram.max:>10.1f}"
+            )
+        self.stdout.write("timings in milliseconds, sizes in bytes")
@@ -0,0 +1,232 @@
+"""Timings and sizes of the components, per component class
+
+When `METRICS` is enabled every measure is added to a histogram of its
+component class and metric, and sent with the `metric_recorded` signal.
+The histograms of each process are published in the `METRICS_CACHE` cache
+every `PUBLISH_INTERVAL` seconds, in a thread as `record` runs in the event
+loop. `manage.py reactor_metrics` shows them.
+
+Timings are in milliseconds and sizes in bytes. The metrics are:
+
+    join          building the component and its `joined` when it joins
+    event         the event handler
+    mutation      `mutations`, with the mutations of a channel
+    notification  `notification`
+    context       building the context of the template
+    template      rendering the template
+    diff          diffing the render with the previous one
+    render        the whole render, `RENDER_BUDGET` applies to it
+    payload       size of the render in the frame sent to the front-end
+    send          sending the renders of a connection, the component is "*"
+"""
+
+import logging
+import math
+import os
+import socket
+import threading
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from time import monotonic, perf_counter
+
+from django.core.cache import caches
+from django.db import close_old_connections
+from django.dispatch import Signal
+
+from . import settings
+
+__all__ = (
+    "metric_recorded",
+    "Histogram",
+    "record",
+    "timed",
+    "snapshot",
+    "publish",
+    "published",
+    "reset",
+)
+
+log = logging.getLogger("reactor")
+
+# sent with `sender` the name of the component, `metric` and `value`
+metric_recorded = Signal()
+
+# the histograms of each process are kept in the cache under this key and
+# the name of the process, the index of the processes is in this key
+CACHE_KEY = "reactor:metrics"
+PUBLISH_INTERVAL = 10
+
+
+class Histogram:
+    """Counts of the values by power of two, so they can be merged"""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        # exponent -> amount of values in [2 ** (exponent - 1), 2 ** exponent)
+        self.buckets: dict[int, int] = {}
+
+    def add(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        exponent = math.frexp(value)[1]
+        self.buckets[exponent] = self.buckets.get(exponent, 0) + 1
+
+    def merge(self, other: "Histogram"):
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for exponent, count in other.buckets.items():
+            self.buckets[exponent] = self.buckets.get(exponent, 0) + count
+
+    def percentile(self, p: float) -> float:
+        """Upper bound of the bucket of the `p` percentile"""
+        seen = 0
+        for exponent in sorted(self.buckets):
+            seen += self.buckets[exponent]
+            if seen >= p / 100 * self.count:
+                return min(math.ldexp(1, exponent), self.max)
+        return self.max
+
+    def to_dict(self) -> dict[str, t.Any]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "buckets": self.buckets,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, t.Any]) -> "Histogram":
+        histogram = cls()
+        histogram.count = data["count"]
+        histogram.sum = data["sum"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        histogram.buckets = {int(e): c for e, c in data["buckets"].items()}
+        return histogram
+
+
+Histograms = dict[tuple[str, str], Histogram]  # (component, metric)
+_histograms: Histograms = {}
+_lock = threading.Lock()  # renders also record from threads
+_published_at = monotonic()
+_publisher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="metrics")
+
+
+def record(component: str, metric: str, value: float):
+    global _published_at
+    if not settings.METRICS:
+        return
+    with _lock:
+        if (histogram := _histograms.get((component, metric))) is None:
+            histogram = _histograms[component, metric] = Histogram()
+        histogram.add(value)
+    metric_recorded.send(sender=component, metric=metric, value=value)
+
+    if (
+        metric == "render"
+        and settings.RENDER_BUDGET is not None
+        and value > settings.RENDER_BUDGET
+    ):
+        log.warning(
+            f"{component} took {value:.1f}ms to render, over the budget of "
+            f"{settings.RENDER_BUDGET}ms"
+        )
+
+    if (now := monotonic()) - _published_at > PUBLISH_INTERVAL:
+        _published_at = now
+        _publisher.submit(_publish_in_background)
+
+
+def _publish_in_background():
+    try:
+        publish()
+    except Exception as e:
+        log.exception(e)
+    finally:
+        # the cache can be in the database
+        close_old_connections()
+
+
+class _Timer:
+    def __init__(self, component: str, metric: str):
+        self.component = component
+        self.metric = metric
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc_info):
+        record(
+            self.component,
+            self.metric,
+            (perf_counter() - self.start) * 1000,
+        )
+
+
+def timed(component: str, metric: str) -> t.ContextManager:
+    """Records how long the `with` block takes"""
+    if settings.METRICS:
+        return _Timer(component, metric)
+    return nullcontext()
+
+
+def snapshot() -> Histograms:
+    """Copy of the histograms of this process"""
+    with _lock:
+        return {
+            key: Histogram.from_dict(histogram.to_dict())
+            for key, histogram in _histograms.items()
+        }
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def publish():
+    cache = caches[settings.METRICS_CACHE]
+    process = f"{socket.gethostname()}:{os.getpid()}"
+    cache.set(
+        f"{CACHE_KEY}:{process}",
+        [
+            (component, metric, histogram.to_dict())
+            for (component, metric), histogram in snapshot().items()
+        ],
+        PUBLISH_INTERVAL * 6,
+    )
+    processes = cache.get(CACHE_KEY) or set()
+    if process not in processes:
+        cache.set(CACHE_KEY, processes | {process}, None)
+
+
+def published() -> Histograms:
+    """The histograms published by all the processes, merged"""
+    cache = caches[settings.METRICS_CACHE]
+    processes = cache.get(CACHE_KEY) or set()
+    found = cache.get_many([f"{CACHE_KEY}:{p}" for p in processes])
+    if len(found) < len(processes):
+        # forget the processes that stopped publishing
+        cache.set(
+            CACHE_KEY,
+            {key.removeprefix(f"{CACHE_KEY}:") for key in found},
+            None,
+        )
+    merged: Histograms = {}
+    for histograms in found.values():
+        for component, metric, data in histograms:
+            histogram = Histogram.from_dict(data)
+            if (key := (component, metric)) in merged:
+                merged[key].merge(histogram)
+            else:
+                merged[key] = histogram
+    return merged
@@ -0,0 +1,153 @@
+"""Binary frames of the `reactor.binary` websocket subprotocol
+
+Only the `render` command is sent in binary frames, the rest of the commands
+are sent as JSON text frames like in the `reactor.json` subprotocol. The
+decoder of the front-end is `decodeFrame` in `reactor.js`.
+
+A render frame is:
+
+    byte     FRAME_RENDER
+    varint   amount of renders
+    renders  each one is:
+        string   id of the component
+        byte     RENDER_DIFF or RENDER_JSON
+        ...      for RENDER_DIFF a varint with the amount of items of the diff
+                 followed by the items, for RENDER_JSON a string with the JSON
+                 of the rest of the render
+
+Strings are a varint with the length in bytes followed by the UTF-8 bytes.
+The items of a diff are a varint `value << 3 | tag` where the tag is:
+
+    ITEM_KEEP       keep `value` tokens
+    ITEM_DELETE     delete `value` tokens
+    ITEM_INSERT     insert the string of `value` bytes that follows
+    ITEM_DEFINE     like ITEM_INSERT, and add the string to the dictionary of
+                    tokens of the connection
+    ITEM_REFERENCE  insert the token number `value` of the dictionary
+"""
+
+import typing as t
+
+from . import codec
+from .diff import EncodedDiff
+
+__all__ = ("BINARY", "JSON", "SUBPROTOCOLS", "encode_renders", "decode_renders")
+
+BINARY = "reactor.binary"
+JSON = "reactor.json"
+SUBPROTOCOLS = (BINARY, JSON)
+
+FRAME_RENDER = 1
+RENDER_DIFF, RENDER_JSON = range(2)
+ITEM_KEEP, ITEM_DELETE, ITEM_INSERT, ITEM_DEFINE, ITEM_REFERENCE = range(5)
+
+Render = dict[str, t.Any]
+
+
+def encode_renders(
+    renders: list[Render], sizes: list[int] | None = None
+) -> bytes:
+    """Encodes a render frame, the size of each render is added to `sizes`"""
+    frame = bytearray([FRAME_RENDER])
+    _write_varint(frame, len(renders))
+    for render in renders:
+        start = len(frame)
+        _write_string(frame, render["id"])
+        if (diff := render.get("diff")) is not None and len(render) == 2:
+            frame.append(RENDER_DIFF)
+            _write_varint(frame, len(diff))
+            for item in diff:
+                if isinstance(item, str):
+                    data = item.encode()
+                    _write_varint(frame, len(data) << 3 | ITEM_INSERT)
+                    frame += data
+                elif isinstance(item, list):
+                    # entries of the token dictionary, see `TokenDictionary`
+                    if isinstance(entry := item[0], str):
+                        data = entry.encode()
+                        _write_varint(frame, len(data) << 3 | ITEM_DEFINE)
+                        frame += data
+                    else:
+                        _write_varint(frame, entry << 3 | ITEM_REFERENCE)
+                elif item > 0:
+                    _write_varint(frame, item << 3 | ITEM_KEEP)
+                else:
+                    _write_varint(frame, -item << 3 | ITEM_DELETE)
+        else:
+            frame.append(RENDER_JSON)
+            _write_string(
+                frame,
+                codec.dumps({k: v for k, v in render.items() if k != "id"}),
+            )
+        if sizes is not None:
+            sizes.append(len(frame) - start)
+    return bytes(frame)
+
+
+def decode_renders(frame: bytes) -> list[Render]:
+    """Inverse of `encode_renders`, the front-end has its own decoder"""
+    assert frame[0] == FRAME_RENDER
+    reader = _Reader(frame, 1)
+    renders = []
+    for _ in range(reader.varint()):
+        render: Render = {"id": reader.string()}
+        kind = reader.byte()
+        if kind == RENDER_DIFF:
+            diff: EncodedDiff = []
+            for _ in range(reader.varint()):
+                item = reader.varint()
+                tag, value = item & 7, item >> 3
+                if tag == ITEM_INSERT:
+                    diff.append(reader.bytes(value).decode())
+                elif tag == ITEM_DEFINE:
+                    diff.append([reader.bytes(value).decode()])
+                elif tag == ITEM_REFERENCE:
+                    diff.append([value])
+                elif tag == ITEM_KEEP:
+                    diff.append(value)
+                else:
+                    diff.append(-value)
+            render["diff"] = diff
+        else:
+            render.update(codec.loads(reader.string()))
+        renders.append(render)
+    return renders
+
+
+def _write_varint(frame: bytearray, value: int):
+    while value > 0x7F:
+        frame.append(value & 0x7F | 0x80)
+        value >>= 7
+    frame.append(value)
+
+
+def _write_string(frame: bytearray, value: str):
+    data = value.encode()
+    _write_varint(frame, len(data))
+    frame += data
+
+
+class _Reader:
+    def __init__(self, frame: bytes, position: int = 0):
+        self.frame = frame
+        self.position = position
+
+    def byte(self) -> int:
+        self.position += 1
+        return self.frame[self.position - 1]
+
+    def bytes(self, length: int) -> bytes:
+        self.position += length
+        return self.frame[self.position - length : self.position]
+
+    def varint(self) -> int:
+        value = shift = 0
+        while True:
+            byte = self.byte()
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def string(self) -> str:
+        return self.bytes(self.varint()).decode()
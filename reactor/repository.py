@@ -1,15 +1,20 @@
 import json
+import logging
 import typing as t
-from functools import reduce
+from time import monotonic
 from urllib.parse import parse_qsl, urlencode
 
 from channels.db import database_sync_to_async as db
 from channels.layers import BaseChannelLayer
 from django.contrib.auth.models import AbstractBaseUser, AnonymousUser
 
-from .component import Component, MessagePayload
+from . import metrics, settings
+from .component import Component, MessagePayload, load_model_instances
+from .state import pack_state, unpack_state
 from .utils import filter_parameters
 
+log = logging.getLogger("reactor")
+
 ChildrenRepo = dict[str, tuple[str, dict[str, t.Any]]]
 
 
@@ -32,6 +37,18 @@ class ComponentRepository:
         self.components: dict[str, Component] = {}
         self.children: ChildrenRepo = {}
         self.is_live = is_live
+        # channel -> ids of the components subscribed to it and vice versa
+        self.subscribers: dict[str, set[str]] = {}
+        self.subscribed_to: dict[str, frozenset[str]] = {}
+        # channels that got their first subscriber or lost the last one
+        # since the last call to `pop_subscription_changes`
+        self.added_subscriptions: set[str] = set()
+        self.removed_subscriptions: set[str] = set()
+        # id -> when the component got its last event, mutation or
+        # notification, and id -> (name, packed state) of the components
+        # hibernated after `HIBERNATE_AFTER` seconds without any
+        self.active_at: dict[str, float] = {}
+        self.hibernated: dict[str, tuple[str, bytes]] = {}
 
     @staticmethod
     def extract_params(qs: str):
@@ -71,12 +88,20 @@ class ComponentRepository:
                 # override with the passed state but preserve the rest of the state
                 for key, value in state.items():
                     setattr(component, key, value)
+                self.refresh_subscriptions(component)
+                self.active_at[component_id] = monotonic()
                 return component
             elif child := self.children.get(component_id):
                 child_name, child_state = child
                 if child_name == name:
                     state = child_state | state
                     self.children.pop(component_id)
+            elif hibernated := self.hibernated.get(component_id):
+                # rendered by its parent
+                hibernated_name, packed = hibernated
+                if hibernated_name == name:
+                    state = unpack_state(packed) | state
+                    self.hibernated.pop(component_id)
 
         component = Component._build(
             name,
@@ -94,42 +119,154 @@ class ComponentRepository:
         state: MessagePayload,
         children: ChildrenRepo | None = None,
     ) -> Component:
-        self.children.update(children or {})
-        component = await db(self.build)(
-            name,
-            state,
-        )
-        await component.joined()
+        children = children or {}
+        self.children.update(children)
+        with metrics.timed(name, "join"):
+            component = await db(self._load_and_build)(
+                name,
+                state,
+                children,
+            )
+            await component.joined()
+        self.refresh_subscriptions(component)
         return component
 
+    def _load_and_build(
+        self, name: str, state: MessagePayload, children: ChildrenRepo
+    ) -> Component:
+        # the children are built while rendering the component, load the
+        # models of all of them at once
+        load_model_instances([(name, state), *children.values()])
+        return self.build(name, state)
+
     def register_component(self, component: Component):
         self.components[component.id] = component
+        self.active_at[component.id] = monotonic()
+        self.refresh_subscriptions(component)
         return component
 
     def remove(self, id):
         self.components.pop(id, None)
+        self.active_at.pop(id, None)
+        self.hibernated.pop(id, None)
+        self._update_subscriptions(id, frozenset())
+
+    def hibernate(self, id: str):
+        """Drops the component `id` keeping only its state, packed
+
+        Its subscriptions stay, it wakes up with `wake` and the next render
+        is sent whole.
+        """
+        component = self.components.pop(id)
+        self.active_at.pop(id, None)
+        self.hibernated[id] = (component._name, pack_state(component))
+
+    def hibernate_idle(self, keep: t.Container[str] = ()):
+        """Hibernates the components idle for `HIBERNATE_AFTER` seconds"""
+        assert settings.HIBERNATE_AFTER is not None
+        idle_since = monotonic() - settings.HIBERNATE_AFTER
+        for id, active_at in list(self.active_at.items()):
+            if active_at > idle_since or id in keep:
+                continue
+            component = self.components[id]
+            if component.reactor._is_frozen or component.reactor._redirected_to:
+                # destroyed or redirected, the state does not keep that
+                continue
+            self.hibernate(id)
+
+    async def wake(self, ids: t.Iterable[str]):
+        """Builds again the hibernated components among `ids`"""
+        hibernated = [
+            (id, *self.hibernated.pop(id))
+            for id in ids
+            if id in self.hibernated
+        ]
+        if hibernated:
+            await db(self._wake)(hibernated)
+
+    def _wake(self, hibernated: list[tuple[str, str, bytes]]):
+        states = [
+            (name, unpack_state(packed)) for _, name, packed in hibernated
+        ]
+        load_model_instances(states)
+        for (id, _, _), (name, state) in zip(hibernated, states):
+            try:
+                self.build(name, state)
+            except Exception as e:
+                log.exception(e)
+                self.remove(id)
+
+    async def wake_subscribed_to(self, channel: str):
+        await self.wake(self.subscribers.get(channel, ()))
 
     async def dispatch_event(self, id, command, args, kwargs):
         assert not command.startswith("_")
+        await self.wake([id])
         component = self.components[id]
+        self.active_at[id] = monotonic()
         handler = getattr(component, command)
-        await handler(*args, **filter_parameters(handler, kwargs))
+        if (signature := component._handlers.get(command)) is not None:
+            kwargs = signature.filter(kwargs)
+        else:
+            kwargs = filter_parameters(handler, kwargs)
+        with metrics.timed(component._name, "event"):
+            await handler(*args, **kwargs)
+        self.refresh_subscriptions(component)
         return component
 
     def components_subscribed_to(self, channel):
-        # XXX: There is a list() here because the dict can change size during
+        # XXX: There is a list() here because the set can change size during
         # iteration
-        for component in list(self.components.values()):
-            if channel in component._subscriptions:
+        for id in list(self.subscribers.get(channel, ())):
+            if component := self.components.get(id):
+                self.active_at[id] = monotonic()
                 yield component
 
     @property
-    def subscriptions(self):
-        return reduce(
-            lambda a, b: a.union(b),
-            (
-                component._subscriptions
-                for component in list(self.components.values())
-            ),
-            set(),
+    def subscriptions(self) -> set[str]:
+        return set(self.subscribers)
+
+    def refresh_subscriptions(self, component: Component):
+        """Updates the index with the current `_subscriptions` of `component`
+
+        Has to be called after anything that can change the state of the
+        component, `_subscriptions` can be a property that depends on it.
+        """
+        self._update_subscriptions(
+            component.id, frozenset(component._subscriptions)
         )
+
+    def _update_subscriptions(self, id: str, channels: frozenset[str]):
+        previous = self.subscribed_to.get(id, frozenset())
+        if channels == previous:
+            return
+
+        if channels:
+            self.subscribed_to[id] = channels
+        else:
+            self.subscribed_to.pop(id, None)
+
+        for channel in channels - previous:
+            if channel not in self.subscribers:
+                self.subscribers[channel] = set()
+                if channel in self.removed_subscriptions:
+                    self.removed_subscriptions.discard(channel)
+                else:
+                    self.added_subscriptions.add(channel)
+            self.subscribers[channel].add(id)
+
+        for channel in previous - channels:
+            subscribers = self.subscribers[channel]
+            subscribers.discard(id)
+            if not subscribers:
+                del self.subscribers[channel]
+                if channel in self.added_subscriptions:
+                    self.added_subscriptions.discard(channel)
+                else:
+                    self.removed_subscriptions.add(channel)
+
+    def pop_subscription_changes(self) -> tuple[set[str], set[str]]:
+        """Returns and clears the channels added and removed"""
+        changes = self.added_subscriptions, self.removed_subscriptions
+        self.added_subscriptions, self.removed_subscriptions = set(), set()
+        return changes
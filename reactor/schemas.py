@@ -1,3 +1,4 @@
+import typing as t
 from enum import StrEnum
 
 from pydantic import BaseModel, Field
@@ -13,6 +14,8 @@ class AutoBroadcast(BaseModel):
     # model-b.9876.model-a-set
     # model-a.1234.model-b-set
     m2m: bool = False
+    # when a model is saved with `update_fields` only send those fields
+    update_fields_only: bool = False
     # this is a set of tuples of ('app_label', 'ModelName')
     # to subscribe for the auto broadcast
     senders: set[tuple[str, str]] = Field(default_factory=set)
@@ -30,6 +33,11 @@ class ModelAction(StrEnum):
     CLEARED = "CLEARED"
 
 
+class Mutation(t.NamedTuple):
+    action: ModelAction
+    instance: t.Any
+
+
 class DomAction(StrEnum):
     APPEND = "append"
     PREPEND = "prepend"
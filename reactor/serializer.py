@@ -1,24 +1,135 @@
 import typing as t
+from copy import deepcopy
+from functools import cache
+from time import monotonic
 
-from django.core.serializers import deserialize, serialize
+from django.apps import apps
+from django.core.serializers import deserialize
 from django.core.serializers.base import DeserializedObject
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db.models import Model
+from django.db.models import Field, Model
+from django.db.models.base import ModelState
+from lru import LRU
 from pydantic import BaseModel
 
+from . import codec, settings
+
 __all__ = ("encode", "decode")
 
+JSON_TYPES = (str, int, float, bool, type(None))
+
+
+def encode(instance: Model, fields: t.Iterable[str] | None = None) -> str:
+    """Encodes the concrete fields of `instance`
+
+    With `fields` (names or attnames) only the primary key and those fields
+    are encoded, the rest of the fields of the decoded instance are deferred.
+    """
+    meta = instance._meta
+    if fields is None:
+        concrete_fields = _concrete_fields(type(instance))
+    else:
+        fields = {meta.pk.name, *fields}
+        concrete_fields = tuple(
+            (attname, field)
+            for attname, field in _concrete_fields(type(instance))
+            # `update_fields` can have names or attnames (`author_id`)
+            if field.name in fields or attname in fields
+        )
+    values = {}
+    for attname, field in concrete_fields:
+        value = getattr(instance, attname)
+        values[attname] = (
+            value
+            if isinstance(value, JSON_TYPES)
+            else field.value_to_string(instance)
+        )
+    return codec.dumps(
+        {"model": meta.label_lower, "fields": values},
+        default=ReactorJSONEncoder().default,
+    )
+
 
-def encode(instance: Model) -> str:
-    return serialize("json", [instance], cls=ReactorJSONEncoder)
+# A broadcast reaches every connection of the process with the same payload,
+# it is decoded once and each connection gets a copy: payload -> (expires at,
+# instance)
+_decoded: dict[str, tuple[float, Model]] = LRU(
+    max(settings.MUTATION_CACHE_SIZE, 1)
+)
 
 
 def decode(instance: str) -> Model:
-    obj: DeserializedObject = list(deserialize("json", instance))[0]
+    """Decodes an instance encoded with `encode`
+
+    Each call returns a new copy of the instance, so the components can
+    change it without changing the instance of the others.
+    """
+    # the format of previous versions is a list, its instances have their
+    # own `save`, see `_decode_serialized`
+    if not settings.MUTATION_CACHE_SIZE or instance.startswith("["):
+        return _decode(instance)
+
+    now = monotonic()
+    cached = _decoded.get(instance)
+    if cached is None or cached[0] < now:
+        cached = _decoded[instance] = (
+            now + settings.MUTATION_CACHE_TTL,
+            _decode(instance),
+        )
+    return _copy(cached[1])
+
+
+def _copy(instance: Model) -> Model:
+    # `copy.deepcopy` of the instance goes through pickling, way slower; the
+    # instances decoded have no related objects cached, so a new state and a
+    # copy of the values that can be mutated (like those of a `JSONField`)
+    # are enough
+    clone = Model.__new__(type(instance))
+    clone.__dict__.update(
+        (name, value if isinstance(value, JSON_TYPES) else deepcopy(value))
+        for name, value in instance.__dict__.items()
+        if name != "_state"
+    )
+    clone._state = ModelState()
+    clone._state.db = instance._state.db
+    clone._state.adding = False
+    return clone
+
+
+def _decode(instance: str) -> Model:
+    data = codec.loads(instance)
+    if isinstance(data, list):
+        return _decode_serialized(data)
+
+    model = apps.get_model(data["model"])
+    fields = _fields_by_attname(model)
+    values = data["fields"]
+    return model.from_db(
+        None,
+        list(values),
+        [fields[attname].to_python(value) for attname, value in values.items()],
+    )
+
+
+def _decode_serialized(data: list[dict[str, t.Any]]) -> Model:
+    # sent by previous versions, same format as Django's "json" serializer
+    obj: DeserializedObject = list(deserialize("python", data))[0]
     obj.object.save = obj.save
     return obj.object
 
 
+@cache
+def _concrete_fields(model: type[Model]) -> tuple[tuple[str, Field], ...]:
+    return tuple(
+        (field.attname, field) for field in model._meta.concrete_fields
+    )
+
+
+@cache
+def _fields_by_attname(model: type[Model]) -> dict[str, Field]:
+    return dict(_concrete_fields(model))
+
+
 class ReactorJSONEncoder(DjangoJSONEncoder):
     def default(self, o: t.Any) -> t.Any:
         if isinstance(o, BaseModel):
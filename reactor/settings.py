@@ -6,9 +6,28 @@ DEBUG = settings.DEBUG
 DEFAULT = {
     "TRANSPILER_CACHE_SIZE": 1024,
     "USE_HTML_DIFF": True,
+    "DIFF_ENGINE": "myers",
+    "RENDER_FLUSH_INTERVAL": 0,
+    "STATE_STORE": None,
+    "STATE_STORE_SIZE": 10_000,
+    "STATE_STORE_CACHE": "default",
+    "STATE_STORE_TIMEOUT": 86_400,
+    "JSON_CODEC": "json",
+    "BINARY_PROTOCOL": False,
+    "TOKEN_DICTIONARY_SIZE": 1_000,
     "USE_HMIN": False,
     "BOOST_PAGES": False,
     "AUTO_BROADCAST": AutoBroadcast(),
+    "BROADCAST_BATCH_SIZE": 100,
+    "MUTATION_BATCH_WINDOW": 0,
+    "MUTATION_CACHE_SIZE": 1024,
+    "MUTATION_CACHE_TTL": 5,
+    "LOCAL_FANOUT": False,
+    "RENDER_PROCESSES": None,
+    "METRICS": False,
+    "METRICS_CACHE": "default",
+    "RENDER_BUDGET": None,
+    "HIBERNATE_AFTER": None,
 }
 
 REACTOR = DEFAULT | getattr(settings, "REACTOR", {})
@@ -16,6 +35,25 @@ LOGIN_URL = settings.LOGIN_URL
 
 TRANSPILER_CACHE_SIZE: int = REACTOR["TRANSPILER_CACHE_SIZE"]
 USE_HTML_DIFF: bool = REACTOR["USE_HTML_DIFF"]
+DIFF_ENGINE: str = REACTOR["DIFF_ENGINE"]
+RENDER_FLUSH_INTERVAL: float = REACTOR["RENDER_FLUSH_INTERVAL"]
+STATE_STORE: str | None = REACTOR["STATE_STORE"]
+STATE_STORE_SIZE: int = REACTOR["STATE_STORE_SIZE"]
+STATE_STORE_CACHE: str = REACTOR["STATE_STORE_CACHE"]
+STATE_STORE_TIMEOUT: float | None = REACTOR["STATE_STORE_TIMEOUT"]
+JSON_CODEC: str = REACTOR["JSON_CODEC"]
+BINARY_PROTOCOL: bool = REACTOR["BINARY_PROTOCOL"]
+TOKEN_DICTIONARY_SIZE: int = REACTOR["TOKEN_DICTIONARY_SIZE"]
 USE_HMIN: bool = REACTOR["USE_HMIN"]
 BOOST_PAGES: bool = REACTOR["BOOST_PAGES"]
 AUTO_BROADCAST: AutoBroadcast = REACTOR["AUTO_BROADCAST"]
+BROADCAST_BATCH_SIZE: int = REACTOR["BROADCAST_BATCH_SIZE"]
+MUTATION_BATCH_WINDOW: float = REACTOR["MUTATION_BATCH_WINDOW"]
+MUTATION_CACHE_SIZE: int = REACTOR["MUTATION_CACHE_SIZE"]
+MUTATION_CACHE_TTL: float = REACTOR["MUTATION_CACHE_TTL"]
+LOCAL_FANOUT: bool = REACTOR["LOCAL_FANOUT"]
+RENDER_PROCESSES: int | None = REACTOR["RENDER_PROCESSES"]
+METRICS: bool = REACTOR["METRICS"]
+METRICS_CACHE: str = REACTOR["METRICS_CACHE"]
+RENDER_BUDGET: float | None = REACTOR["RENDER_BUDGET"]
+HIBERNATE_AFTER: float | None = REACTOR["HIBERNATE_AFTER"]
@@ -0,0 +1,84 @@
+import logging
+import typing as t
+from weakref import WeakKeyDictionary
+
+from django.template.backends.django import Template as DjangoTemplate
+from django.template.base import Node, TextNode
+from django.template.context import make_context
+from django.template.defaulttags import CommentNode, LoadNode
+from django.template.loader_tags import ExtendsNode
+
+__all__ = ("SlottedTemplate", "compile_template")
+
+log = logging.getLogger("reactor")
+
+# Nodes that don't render anything, they are part of the statics
+SILENT_NODES = (LoadNode, CommentNode)
+
+_compiled: WeakKeyDictionary[t.Any, "SlottedTemplate | None"] = (
+    WeakKeyDictionary()
+)
+
+
+class SlottedTemplate:
+    """A template split in static fragments and dynamic slots
+
+    Like the rendered structs of Phoenix LiveView, the top level text of the
+    template is sent once and after that only the output of the top level
+    tags and variables that changed.
+
+    The rendered HTML is `statics[0] + slots[0] + statics[1] + ...`, so there
+    is always one more static than slots.
+    """
+
+    def __init__(self, template: DjangoTemplate):
+        self.template = template.template
+        self.statics: list[str] = []
+        self.nodes: list[Node] = []
+
+        text: list[str] = []
+        for node in self.template.nodelist:
+            if isinstance(node, TextNode):
+                text.append(node.s)
+            elif not isinstance(node, SILENT_NODES):
+                self.statics.append("".join(text))
+                self.nodes.append(node)
+                text = []
+        self.statics.append("".join(text))
+
+        self.statics[0] = self.statics[0].lstrip()
+        self.statics[-1] = self.statics[-1].rstrip()
+
+    def render(self, context: dict[str, t.Any]) -> list[str]:
+        ctx = make_context(context, autoescape=self.template.engine.autoescape)
+        with ctx.render_context.push_state(self.template):
+            with ctx.bind_template(self.template):
+                ctx.template_name = self.template.name
+                return [node.render_annotated(ctx) for node in self.nodes]
+
+
+def compile_template(template: t.Any) -> SlottedTemplate | None:
+    """Returns the slotted version of `template` or `None` if it can't be split
+
+    Only templates of the Django template engine that don't extend other
+    templates can be split.
+    """
+    try:
+        return _compiled[template]
+    except KeyError:
+        slotted = None
+        if not isinstance(template, DjangoTemplate):
+            log.warning(
+                f"Can't render {template} in slots, it is not a Django template"
+            )
+        elif any(
+            isinstance(n, ExtendsNode) for n in template.template.nodelist
+        ):
+            log.warning(
+                f"Can't render {template.origin} in slots, it extends another "
+                "template"
+            )
+        else:
+            slotted = SlottedTemplate(template)
+        _compiled[template] = slotted
+        return slotted
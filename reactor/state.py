@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import typing as t
+import zlib
+from hashlib import blake2b
+
+from django.core.cache import caches
+from django.core.signing import Signer, b64_decode, b64_encode
+from lru import LRU
+
+from . import codec, settings
+
+if t.TYPE_CHECKING:
+    from .component import Component
+
+log = logging.getLogger("reactor")
+
+__all__ = (
+    "encode_state",
+    "decode_state",
+    "adecode_states",
+    "pack_state",
+    "unpack_state",
+    "StateExpired",
+)
+
+# Compressed states start with this prefix, plain states are a JSON object
+# so they start with "{"
+COMPRESSED = "."
+# States kept in the state store are replaced by their key with this prefix
+STORED = "@"
+
+
+class StateExpired(LookupError):
+    pass
+
+
+class MemoryStore:
+    """Keeps the states in an LRU dict of this process
+
+    Only works if the connections land in the same process that rendered
+    the page.
+    """
+
+    def __init__(self, size: int):
+        self.states: dict[str, str] = LRU(size)
+
+    def set(self, key: str, data: str):
+        self.states[key] = data
+
+    async def aget_many(self, keys: t.Iterable[str]) -> dict[str, str]:
+        return {key: self.states[key] for key in keys if key in self.states}
+
+
+class CacheStore:
+    """Keeps the states in a Django cache for `STATE_STORE_TIMEOUT` seconds
+
+    Components rendered in the event loop (`_async_render`) don't wait for
+    the cache, their states are kept in `pending` until they are stored.
+    """
+
+    def __init__(self, alias: str):
+        self.cache = caches[alias]
+        self.pending: dict[str, str] = {}
+        # keeps a reference to the tasks, asyncio only keeps weak ones
+        self.tasks: set[asyncio.Task] = set()
+
+    def set(self, key: str, data: str):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.cache.set(key, data, settings.STATE_STORE_TIMEOUT)
+        else:
+            self.pending[key] = data
+            task = loop.create_task(self._aset(key, data))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _aset(self, key: str, data: str):
+        try:
+            await self.cache.aset(key, data, settings.STATE_STORE_TIMEOUT)
+        except Exception as e:
+            log.exception(e)
+        finally:
+            self.pending.pop(key, None)
+
+    async def aget_many(self, keys: t.Iterable[str]) -> dict[str, str]:
+        keys = list(keys)
+        found = {key: self.pending[key] for key in keys if key in self.pending}
+        if missing := [key for key in keys if key not in found]:
+            found |= await self.cache.aget_many(missing)
+        return found
+
+
+StateStore = MemoryStore | CacheStore
+
+
+def _get_store() -> StateStore | None:
+    if settings.STATE_STORE == "memory":
+        return MemoryStore(settings.STATE_STORE_SIZE)
+    elif settings.STATE_STORE == "cache":
+        return CacheStore(settings.STATE_STORE_CACHE)
+    elif settings.STATE_STORE is not None:
+        raise ValueError(
+            f"Unknown state store {settings.STATE_STORE!r}, use one of: "
+            "None, 'memory', 'cache'"
+        )
+
+
+store = _get_store()
+
+
+def encode_state(component: "Component") -> str:
+    """Signed state of `component`, as sent in the `data-state` attribute
+
+    Components with `_compress_state` send their state compressed with zlib
+    and encoded in base64url, when that is shorter than the JSON. With a
+    `STATE_STORE` the state is kept in the server and only its key is sent.
+    """
+    data = component.json(exclude=component._exclude_fields)
+    if component._compress_state:
+        compressed = (
+            COMPRESSED + b64_encode(zlib.compress(data.encode())).decode()
+        )
+        if len(compressed) < len(data):
+            data = compressed
+    if store is not None:
+        digest = blake2b(data.encode(), digest_size=16).hexdigest()
+        key = f"reactor:state:{digest}"
+        store.set(key, data)
+        data = STORED + key
+    return Signer().sign(data)
+
+
+def decode_state(state: str) -> dict[str, t.Any]:
+    """Verifies and decodes a state that was not kept in the state store"""
+    return _decode(Signer().unsign(state))
+
+
+async def adecode_states(states: list[str]) -> list[dict[str, t.Any]]:
+    """Verifies and decodes the states produced by `encode_state`
+
+    The states kept in the state store are fetched all at once, raises
+    `StateExpired` if any of them is not there anymore.
+    """
+    signer = Signer()
+    values = [signer.unsign(state) for state in states]
+    keys = [value[1:] for value in values if value.startswith(STORED)]
+    if keys:
+        if store is None:
+            raise StateExpired("There is no state store configured")
+        stored = await store.aget_many(keys)
+        if missing := set(keys) - set(stored):
+            raise StateExpired(f"States not found: {', '.join(missing)}")
+        values = [
+            stored[value[1:]] if value.startswith(STORED) else value
+            for value in values
+        ]
+    return [_decode(value) for value in values]
+
+
+def pack_state(component: "Component") -> bytes:
+    """State of `component` kept in the server while it hibernates
+
+    It never leaves the server, so it is not signed.
+    """
+    data = component.json(exclude=component._exclude_fields)
+    return zlib.compress(data.encode())
+
+
+def unpack_state(data: bytes) -> dict[str, t.Any]:
+    return codec.loads(zlib.decompress(data))
+
+
+def _decode(data: str) -> dict[str, t.Any]:
+    if data.startswith(STORED):
+        raise StateExpired(
+            "The state is in the state store, use adecode_states"
+        )
+    if data.startswith(COMPRESSED):
+        data = zlib.decompress(b64_decode(data[1:].encode())).decode()
+    return codec.loads(data)
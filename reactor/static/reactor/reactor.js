@@ -4,24 +4,93 @@ import boost from "./reactor-boost";
 // Connection
 
 const parser = new DOMParser();
+const textDecoder = new TextDecoder();
+
+// Binary frames of the "reactor.binary" subprotocol, see `reactor/protocol.py`
+const FRAME_RENDER = 1;
+const RENDER_DIFF = 0;
+const ITEM_KEEP = 0;
+const ITEM_DELETE = 1;
+const ITEM_INSERT = 2;
+const ITEM_DEFINE = 3;
+const ITEM_REFERENCE = 4;
+
+/**
+ * Decodes a binary frame into a message like the ones sent as JSON
+ * @param {ArrayBuffer} buffer
+ * @returns {{command: String, payload: any}}
+ */
+function decodeFrame(buffer) {
+  let bytes = new Uint8Array(buffer);
+  let position = 0;
+  let varint = () => {
+    let value = 0;
+    let factor = 1;
+    let byte;
+    do {
+      byte = bytes[position++];
+      value += (byte & 0x7f) * factor;
+      factor *= 128;
+    } while (byte & 0x80);
+    return value;
+  };
+  let string = (length = varint()) =>
+    textDecoder.decode(bytes.subarray(position, (position += length)));
+
+  if (bytes[position++] !== FRAME_RENDER) {
+    throw new Error(`Unknown frame type ${bytes[0]}`);
+  }
+  let payload = [];
+  for (let amount = varint(); amount > 0; amount--) {
+    let render = { id: string() };
+    if (bytes[position++] === RENDER_DIFF) {
+      let diff = [];
+      for (let items = varint(); items > 0; items--) {
+        let item = varint();
+        let tag = item % 8;
+        let value = Math.floor(item / 8);
+        if (tag === ITEM_INSERT) {
+          diff.push(string(value));
+        } else if (tag === ITEM_DEFINE) {
+          diff.push([string(value)]);
+        } else if (tag === ITEM_REFERENCE) {
+          diff.push([value]);
+        } else if (tag === ITEM_KEEP) {
+          diff.push(value);
+        } else if (tag === ITEM_DELETE) {
+          diff.push(-value);
+        }
+      }
+      render.diff = diff;
+    } else {
+      Object.assign(render, JSON.parse(string()));
+    }
+    payload.push(render);
+  }
+  return { command: "render", payload };
+}
 
 class ServerConnection {
   constructor() {
     this.components = {};
+    this.tokens = [];
   }
 
   open(path = "__reactor__") {
     let protocol = location.protocol.replace("http", "ws");
     this.socket = new ReconnectingWebSocket(
       `${protocol}//${location.host}/${path}`,
-      [],
+      ["reactor.binary", "reactor.json"],
       {
         maxEnqueuedMessages: 0,
       }
     );
 
+    this.socket.binaryType = "arraybuffer";
+
     this.socket.addEventListener("open", () => {
       console.log("WS: OPEN");
+      this.tokens = [];
       this.sendQueryString();
       this.components = {};
       this.joinAllComponents();
@@ -71,12 +140,25 @@ class ServerConnection {
   }
 
   _processMessage(event) {
-    let { command, payload } = JSON.parse(event.data);
+    let { command, payload } =
+      typeof event.data === "string"
+        ? JSON.parse(event.data)
+        : decodeFrame(event.data);
     switch (command) {
       case "render":
-        var { id, diff } = payload;
-        console.log("<<< RENDER", id);
-        this.components[id]?.applyDiff(diff);
+        // renders of all the components that changed since the last message
+        for (let { id, diff, patches, attributes, statics, slots } of payload) {
+          console.log("<<< RENDER", id);
+          // resolve now, the diffs have to be processed in order
+          diff = diff && this.resolveTokens(diff);
+          if (patches) {
+            this.components[id]?.applyPatches(patches, attributes);
+          } else if (slots) {
+            this.components[id]?.applySlots(statics, slots);
+          } else {
+            this.components[id]?.applyDiff(diff);
+          }
+        }
         break;
       case "append":
       case "prepend":
@@ -159,11 +241,33 @@ class ServerConnection {
       case "back":
         boost.HistoryCache.back();
         break;
+      case "reload":
+        console.log("<< RELOAD");
+        location.reload();
+        break;
       default:
         console.error(`Unknown command "${command}"`, payload);
     }
   }
 
+  /**
+   * Replaces the entries of the token dictionary in a diff by their tokens
+   * @param {Array<String|Number|Array<String|Number>>} diff
+   */
+  resolveTokens(diff) {
+    return diff.map((item) => {
+      if (!Array.isArray(item)) {
+        return item;
+      }
+      let [entry] = item;
+      if (typeof entry === "string") {
+        this.tokens.push(entry);
+        return entry;
+      }
+      return this.tokens[entry];
+    });
+  }
+
   sendQueryString() {
     // "?a=x&..." -> "a=x&..."
     let qs = document.location.search.slice(1);
@@ -204,6 +308,8 @@ class ReactorComponent {
   constructor(id) {
     this.id = id;
     this.lastReceivedHtml = [];
+    this.statics = [];
+    this.slots = [];
   }
 
   getElemenet() {
@@ -221,6 +327,89 @@ class ReactorComponent {
     });
   }
 
+  /**
+   * Morphs only the keyed subtrees that changed
+   * @param {Array<[Array<String>, String]>} patches pairs of the path of CSS
+   *  selectors from the component root to the subtree, and its new HTML
+   * @param {Array<[Array<String>, String]>} attributes pairs of the path to
+   *  an element and its new start tag, when only its attributes changed
+   */
+  applyPatches(patches, attributes) {
+    window.requestAnimationFrame(() => {
+      let el = this.getElemenet();
+      if (el) {
+        // each step is a keyed child of the previous one, skip the matches
+        // nested inside other keyed elements
+        let isKeyedChildOf = (parent) => (node) =>
+          node.parentElement.closest("[id],[data-key]") === parent;
+        let find = (path) =>
+          path.reduce(
+            (parent, selector) =>
+              parent &&
+              Array.from(parent.querySelectorAll(selector)).find(
+                isKeyedChildOf(parent)
+              ),
+            el
+          );
+
+        for (let [path, tag] of attributes) {
+          let target = find(path);
+          if (target) {
+            let template = document.createElement("template");
+            template.innerHTML = tag;
+            let source = template.content.firstElementChild;
+            for (let name of target.getAttributeNames()) {
+              if (!source.hasAttribute(name)) {
+                target.removeAttribute(name);
+              }
+            }
+            for (let name of source.getAttributeNames()) {
+              target.setAttribute(name, source.getAttribute(name));
+            }
+          }
+        }
+
+        for (let [path, html] of patches) {
+          let target = find(path);
+          if (target) {
+            boost.morph(target, html);
+          }
+        }
+        boost.navEvent.sendNewContent();
+      }
+    });
+  }
+
+  /**
+   * Rebuilds the HTML of the component from the static fragments of its
+   * template and the rendered slots
+   * @param {?Array<String>} statics only sent on the first render
+   * @param {Array<String>|Object<Number, String>} slots all the slots on
+   *  the first render, after that only the ones that changed by index
+   */
+  applySlots(statics, slots) {
+    if (statics) {
+      this.statics = statics;
+      this.slots = slots;
+    } else {
+      for (let [index, value] of Object.entries(slots)) {
+        this.slots[index] = value;
+      }
+    }
+    let fragments = [this.statics[0]];
+    this.slots.forEach((slot, index) =>
+      fragments.push(slot, this.statics[index + 1])
+    );
+    let html = fragments.join("").trim();
+    window.requestAnimationFrame(() => {
+      let el = this.getElemenet();
+      if (el) {
+        boost.morph(el, html);
+        boost.navEvent.sendNewContent();
+      }
+    });
+  }
+
   getHtml(diff) {
     let fragments = [];
     let cursor = 0;
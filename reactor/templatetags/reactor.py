@@ -1,14 +1,15 @@
+import types
 import typing as t
 
 from django import template
-from django.core.signing import Signer
 from django.template.base import Node, Parser, Token
 from django.utils.html import format_html
 
 from .. import settings
-from ..component import Component
+from ..component import Component, LazyAttribute
 from ..event_transpiler import transpile
 from ..repository import ComponentRepository
+from ..state import encode_state
 
 register = template.Library()
 
@@ -33,7 +34,7 @@ def tag_header(context):
         id=component.id,
         name=component._name,
         is_live=str(repo.is_live).lower(),
-        state=Signer().sign(component.json(exclude=component._exclude_fields)),
+        state=encode_state(component),
     )
 
 
@@ -116,13 +117,35 @@ def class_cond(parser: Parser, token: Token):
 class CondNode(Node):
     def __init__(self, dict_expression):
         self.dict_expression = dict_expression
+        self.code = compile(dict_expression, "<cond>", "eval")
+        self.names = _names_of(self.code)
 
     def render(self, context):
-        variables: dict[str, t.Any] = context.flatten()  # type: ignore
-        terms = eval(self.dict_expression, variables)
+        # the variables go in the globals, comprehensions and lambdas don't
+        # see the locals of `eval`
+        variables: dict[str, t.Any] = {}
+        for name in self.names:
+            try:
+                value = context[name]
+            except KeyError:
+                continue
+            if isinstance(value, LazyAttribute):
+                # lazy properties are only evaluated if they are used
+                value = value()
+            variables[name] = value
+        terms = eval(self.code, variables)
         return " ".join(term for term, ok in terms.items() if ok)
 
 
+def _names_of(code: types.CodeType) -> frozenset[str]:
+    """Names used by `code` and the comprehensions and lambdas inside it"""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _names_of(const)
+    return frozenset(names)
+
+
 class ClassNode(CondNode):
     def render(self, *args, **kwargs):
         text = super().render(*args, **kwargs)
@@ -1,14 +1,19 @@
+import asyncio
 import inspect
 import logging
+import threading
 import typing as t
 from collections import defaultdict
-from functools import wraps
+from functools import cache, wraps
 
 from asgiref.sync import async_to_sync
 from channels.db import database_sync_to_async as db
 from channels.layers import get_channel_layer
+from django.db import transaction
 from django.utils.datastructures import MultiValueDict
 
+from .settings import BROADCAST_BATCH_SIZE
+
 log = logging.getLogger("reactor")
 
 P = t.ParamSpec("P")
@@ -18,7 +23,9 @@ __all__ = (
     "db",
     "send_to",
     "send_notification",
+    "broadcast_mutation",
     "filter_parameters",
+    "Handler",
     "parse_request_data",
 )
 
@@ -48,22 +55,200 @@ def send_notification(channel: str, **kwargs):
     send_to(channel, "notification", kwargs=kwargs)
 
 
+# Mutations broadcasted in a transaction, sent together when it commits.
+#
+# There is one buffer per transaction. The mutations made in a savepoint are
+# recorded with a marker registered with `on_commit` in that savepoint, so
+# if it is rolled back Django discards the marker and the flush leaves out
+# its mutations. The flush is registered after the last marker and out of
+# any savepoint, a rollback of a savepoint doesn't discard it. This uses the
+# `(savepoint ids, callback, robust)` entries of `run_on_commit` of Django 4.2.
+MutationKey = tuple[str, str, t.Hashable]  # channel, action, instance key
+_broadcasts = threading.local()
+
+
+def broadcast_mutation(
+    channel: str, action: str, instance: str, instance_key: t.Hashable
+):
+    """Sends a mutation to `channel` when the current transaction commits
+
+    A mutation of the same instance with the same action is only sent once,
+    with the last version of the instance.
+    """
+    connection = transaction.get_connection()
+    key = (channel, action, instance_key)
+    if not connection.in_atomic_block:
+        # out of a transaction nothing is pending, send it right away
+        _broadcasts.buffer = None
+        buffer = _MutationBuffer()
+        buffer.record(connection, key, instance)
+        buffer()
+        return
+
+    buffer = getattr(_broadcasts, "buffer", None)
+    if buffer is None or not buffer.is_pending(connection):
+        # the previous transaction was committed or rolled back
+        buffer = _broadcasts.buffer = _MutationBuffer()
+    buffer.record(connection, key, instance)
+
+
+class _Savepoint:
+    """Registered with `on_commit` in a savepoint, runs if it was kept"""
+
+    __slots__ = ("committed",)
+
+    def __init__(self):
+        self.committed = False
+
+    def __call__(self):
+        self.committed = True
+
+
+class _Flush:
+    """Flushes the buffer if it is the last one registered for it"""
+
+    __slots__ = ("buffer",)
+
+    def __init__(self, buffer: "_MutationBuffer"):
+        self.buffer = buffer
+
+    def __call__(self):
+        if self.buffer.flush is self:
+            self.buffer()
+
+
+class _MutationBuffer:
+    def __init__(self):
+        # the mutations in the order they were made, with the savepoint
+        self.journal: list[tuple[_Savepoint | None, MutationKey, str]] = []
+        self.savepoints: dict[tuple[str, ...], _Savepoint] = {}
+        self.flush: _Flush | None = None
+        self.flushed = False
+        # Django replaces the list of callbacks when the transaction ends or
+        # a savepoint is rolled back
+        self.callbacks: list[t.Any] = []
+
+    def record(self, connection, key: MutationKey, instance: str):
+        savepoint = None
+        if connection.savepoint_ids:
+            sids = tuple(connection.savepoint_ids)
+            if (savepoint := self.savepoints.get(sids)) is None:
+                savepoint = self.savepoints[sids] = _Savepoint()
+                transaction.on_commit(savepoint)
+                self._register_flush(connection)
+        elif self.flush is None and connection.in_atomic_block:
+            self._register_flush(connection)
+        self.journal.append((savepoint, key, instance))
+
+    def _register_flush(self, connection):
+        # like `on_commit` out of the savepoints, the previous flush stays
+        # in the callbacks but does nothing
+        self.flush = _Flush(self)
+        self.callbacks = connection.run_on_commit
+        self.callbacks.append((set(), self.flush, False))
+
+    def is_pending(self, connection) -> bool:
+        if self.flush is None or self.flushed:
+            return False
+        if connection.run_on_commit is not self.callbacks:
+            # a savepoint was rolled back, or the whole transaction
+            self.callbacks = connection.run_on_commit
+            if not any(
+                callback is self.flush
+                for _, callback, _ in reversed(self.callbacks)
+            ):
+                self.flush = None
+        return self.flush is not None
+
+    def __call__(self):
+        self.flushed = True
+        mutations: dict[MutationKey, str] = {}
+        for savepoint, key, instance in self.journal:
+            if savepoint is None or savepoint.committed:
+                # send it in the order of its last change
+                mutations.pop(key, None)
+                mutations[key] = instance
+        self.journal = []
+
+        by_channel: dict[str, list[dict[str, str]]] = defaultdict(list)
+        for (channel, action, _), instance in mutations.items():
+            by_channel[channel].append({"action": action, "instance": instance})
+
+        messages = []
+        for channel, batch in by_channel.items():
+            for i in range(0, len(batch), BROADCAST_BATCH_SIZE):
+                messages.append(
+                    (
+                        channel,
+                        {
+                            "type": "model_mutations",
+                            "channel": channel,
+                            "mutations": batch[i : i + BROADCAST_BATCH_SIZE],
+                        },
+                    )
+                )
+        if messages:
+            async_to_sync(_group_send_all)(messages)
+
+
+async def _group_send_all(messages: list[tuple[str, dict[str, t.Any]]]):
+    channel_layer = get_channel_layer()
+    await asyncio.gather(
+        *(
+            channel_layer.group_send(channel, message)
+            for channel, message in messages
+        )
+    )
+
+
 # Introspection
 
 
+class Handler(t.NamedTuple):
+    """What an event handler accepts, to filter the arguments sent to it"""
+
+    accepts_kwargs: bool
+    parameters: frozenset[str]
+
+    @classmethod
+    def of(cls, f: t.Callable[..., t.Any]) -> "Handler":
+        parameters = inspect.signature(f).parameters.values()
+        return cls(
+            accepts_kwargs=any(
+                param.kind == inspect.Parameter.VAR_KEYWORD
+                for param in parameters
+            ),
+            parameters=frozenset(
+                param.name
+                for param in parameters
+                if param.name != "self"
+                and param.kind
+                not in (
+                    inspect.Parameter.VAR_POSITIONAL,
+                    inspect.Parameter.VAR_KEYWORD,
+                )
+            ),
+        )
+
+    def filter(self, kwargs: dict[str, t.Any]) -> dict[str, t.Any]:
+        if self.accepts_kwargs:
+            return kwargs
+        else:
+            return {
+                param: value
+                for param, value in kwargs.items()
+                if param in self.parameters
+            }
+
+
+@cache
+def _handler_of(f: t.Callable[..., t.Any]) -> Handler:
+    return Handler.of(f)
+
+
 def filter_parameters(f, kwargs):
-    has_kwargs = any(
-        param.kind == inspect.Parameter.VAR_KEYWORD
-        for param in inspect.signature(f).parameters.values()
-    )
-    if has_kwargs:
-        return kwargs
-    else:
-        return {
-            param: value
-            for param, value in kwargs.items()
-            if param in f.model.__fields__
-        }
+    # bound methods are created on each access, cache their function instead
+    return _handler_of(getattr(f, "__func__", f)).filter(kwargs)
 
 
 # Decoder for client requests
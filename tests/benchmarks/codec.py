@@ -0,0 +1,111 @@
+"""Compares the JSON codecs and the binary protocol encoding frames
+
+Run it from the `tests` directory:
+
+    python -m benchmarks.codec --components 50
+"""
+
+import argparse
+import os
+import timeit
+
+import django
+
+
+def render_frames(components: int) -> dict[str, dict]:
+    tokens = []
+    for pk in range(200):
+        tokens.extend(
+            [
+                f'<tr id="row-{pk}"',
+                'class="pending">',
+                f'<td class="text">task number {pk}</td>',
+                "</tr>",
+            ]
+        )
+    return {
+        "first render": {
+            "command": "render",
+            "payload": [{"id": "rx-table", "diff": tokens}],
+        },
+        "diffs": {
+            "command": "render",
+            "payload": [
+                {
+                    "id": f"item-{i}",
+                    "diff": [13, -1, 'class="completed">', 14, -1, "checked"],
+                }
+                for i in range(components)
+            ],
+        },
+        "slots": {
+            "command": "render",
+            "payload": [
+                {"id": f"item-{i}", "slots": {1: "completed", 3: "checked"}}
+                for i in range(components)
+            ],
+        },
+        "user event": {
+            "command": "user_event",
+            "payload": {
+                "id": "item-1",
+                "command": "save",
+                "implicit_args": {"text": ["new text"]},
+                "explicit_args": {},
+            },
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--components", type=int, default=50)
+    parser.add_argument("--number", type=int, default=1000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fision.settings")
+    django.setup()
+    from reactor.codec import CODECS
+    from reactor.protocol import encode_renders
+
+    frames = render_frames(args.components)
+    print(f"{'frame':<14}{'bytes':>8}" + "".join(f"{c:>24}" for c in CODECS))
+    for name, frame in frames.items():
+        size = len(CODECS["json"].dumps(frame))
+        timings = []
+        for codec in CODECS.values():
+            text = codec.dumps(frame)
+            encode = min(
+                timeit.repeat(
+                    lambda: codec.dumps(frame), number=args.number, repeat=3
+                )
+            )
+            decode = min(
+                timeit.repeat(
+                    lambda: codec.loads(text), number=args.number, repeat=3
+                )
+            )
+            timings.append(
+                f"{encode / args.number * 1e6:>9.1f} / "
+                f"{decode / args.number * 1e6:>6.1f} µs"
+            )
+        print(f"{name:<14}{size:>8}" + "".join(f"{t:>24}" for t in timings))
+    print("timings are encode / decode per frame")
+
+    print(f"\n{'frame':<14}{'bytes':>8}  binary frame (reactor.binary)")
+    for name, frame in frames.items():
+        if frame["command"] == "render":
+            renders = frame["payload"]
+            size = len(encode_renders(renders))
+            encode = min(
+                timeit.repeat(
+                    lambda: encode_renders(renders),
+                    number=args.number,
+                    repeat=3,
+                )
+            )
+            print(f"{name:<14}{size:>8}  {encode / args.number * 1e6:.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Compares the diff engines on a re-render of a big table component
+
+Run it from the `tests` directory:
+
+    python -m benchmarks.diff --rows 2000
+"""
+import argparse
+import random
+import timeit
+
+from reactor.diff import ENGINES
+
+
+def render_table(rows: list[tuple[int, str, bool]]) -> list[str]:
+    html = ['<div id="rx-table" reactor-component>', "<table>"]
+    for pk, text, done in rows:
+        html.append(
+            f'<tr id="row-{pk}" class="{"done" if done else "pending"}">'
+            f'<td class="text">{text}</td>'
+            f'<td class="actions"><button onclick="reactor.send(event.target,'
+            f" 'toggle', {{}})\">toggle</button></td></tr>"
+        )
+    html.append("</table></div>")
+    return " ".join(html).split(" ")
+
+
+def scenarios(amount: int):
+    rows = [(pk, f"task number {pk}", False) for pk in range(amount)]
+    old = render_table(rows)
+
+    one_changed = list(rows)
+    one_changed[amount // 2] = (amount // 2, "edited task", True)
+
+    inserted = list(rows)
+    inserted.insert(amount // 3, (amount, "brand new task", False))
+
+    removed = list(rows)
+    del removed[amount // 4]
+
+    ten_percent = [
+        (pk, text, not done) if random.random() < 0.1 else (pk, text, done)
+        for pk, text, done in rows
+    ]
+
+    return old, {
+        "unchanged": old,
+        "one row changed": render_table(one_changed),
+        "one row inserted": render_table(inserted),
+        "one row removed": render_table(removed),
+        "10% rows changed": render_table(ten_percent),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(0)
+    old, cases = scenarios(args.rows)
+    print(f"{args.rows} rows, {len(old)} tokens")
+    print(f"{'case':<20}" + "".join(f"{name:>14}" for name in ENGINES))
+    for case, new in cases.items():
+        timings = []
+        for engine in ENGINES.values():
+            best = min(
+                timeit.repeat(
+                    lambda: engine(old, new), number=1, repeat=args.repeat
+                )
+            )
+            timings.append(f"{best * 1000:>11.2f} ms")
+        print(f"{case:<20}" + "".join(timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Simulates clients of the todo list to measure the consumer under load
+
+Each client joins `XTodoList` and its `XTodoItem` children through a
+`WebsocketCommunicator` and fires user events, then the items are saved to
+broadcast mutations to all the clients. Everything runs in this process
+with the in-memory channel layer and a temporary SQLite database.
+
+Run it from the `tests` directory:
+
+    python -m benchmarks.load --clients 50 --events 20 --mutations 20
+"""
+
+import argparse
+import asyncio
+import html
+import os
+import re
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+import django
+
+
+class SimulatedClient:
+    def __init__(self, communicator):
+        self.communicator = communicator
+        self.renders: asyncio.Queue[float] = asyncio.Queue()
+        self.bytes_received = 0
+        self.reader: asyncio.Task | None = None
+
+    async def connect(self, components: list[tuple[str, str, str]]):
+        from reactor import codec
+
+        await self.communicator.connect()
+        (_, name, state), *children = components
+        await self.send(
+            "join",
+            name=name,
+            state=state,
+            children={id: [name, state] for id, name, state in children},
+        )
+        self.reader = asyncio.create_task(self._read(codec))
+        await self.next_render()
+
+    async def send(self, _command: str, **payload):
+        await self.communicator.send_json_to(
+            {"command": _command, "payload": payload}
+        )
+
+    async def next_render(self, after: float = 0, timeout: float = 10) -> float:
+        """When the first render that arrived `after` that time arrived"""
+        while (arrived_at := await self._next(timeout)) < after:
+            # the rest of the renders of a previous event or mutation
+            pass
+        return arrived_at
+
+    async def _next(self, timeout: float) -> float:
+        return await asyncio.wait_for(self.renders.get(), timeout)
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+        await self.communicator.disconnect()
+
+    async def _read(self, codec):
+        while True:
+            message = await self.communicator.receive_output(timeout=3600)
+            arrived_at = perf_counter()
+            if message["type"] != "websocket.send":
+                continue
+            if (data := message.get("bytes")) is not None:
+                # only the renders are sent in binary frames
+                self.bytes_received += len(data)
+                self.renders.put_nowait(arrived_at)
+            else:
+                data = message["text"]
+                self.bytes_received += len(data.encode())
+                if codec.loads(data)["command"] == "render":
+                    self.renders.put_nowait(arrived_at)
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def setup(binary: bool):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fision.settings")
+    from django.conf import settings
+
+    settings.CHANNEL_LAYERS = {
+        "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
+    }
+    settings.DATABASES["default"]["NAME"] = os.path.join(
+        tempfile.mkdtemp(), "load.sqlite3"
+    )
+    settings.DATABASES["default"]["ATOMIC_REQUESTS"] = False
+    settings.REACTOR = {**settings.REACTOR, "BINARY_PROTOCOL": binary}
+    settings.LOGGING["loggers"]["reactor"]["level"] = "WARNING"
+    django.setup()
+
+    from django.core.management import call_command
+
+    call_command("migrate", verbosity=0)
+
+
+def page_components(items: int) -> list[tuple[str, str, str]]:
+    from django.test import Client
+
+    from fision.todo.models import Item
+
+    for i in range(items):
+        Item.objects.create(text=f"task number {i}")
+    page = Client().get("/todo").content.decode()
+    return [
+        (id, name, html.unescape(state))
+        for id, name, state in re.findall(
+            r'id="([^"]+)" data-name="([^"]+)" data-state="([^"]+)"', page
+        )
+    ]
+
+
+async def run(args, components: list[tuple[str, str, str]]):
+    from channels.testing import WebsocketCommunicator
+
+    from fision.asgi import application
+    from fision.todo.models import Item
+    from reactor import protocol
+
+    subprotocols = [protocol.BINARY, protocol.JSON] if args.binary else None
+
+    tracemalloc.start()
+    started_with = tracemalloc.get_traced_memory()[0]
+    clients = []
+    for _ in range(args.clients):
+        client = SimulatedClient(
+            WebsocketCommunicator(
+                application, "/__reactor__", subprotocols=subprotocols
+            )
+        )
+        await client.connect(components)
+        clients.append(client)
+    memory = (tracemalloc.get_traced_memory()[0] - started_with) / args.clients
+    tracemalloc.stop()
+    print(f"{args.clients} clients joined, {memory / 1024:.1f} KiB each")
+
+    root_id = components[0][0]
+    showing = ["completed", "active", "all"]
+
+    async def fire_events(client: SimulatedClient) -> list[float]:
+        latencies = []
+        for i in range(args.events):
+            sent_at = perf_counter()
+            await client.send(
+                "user_event",
+                id=root_id,
+                command="show",
+                implicit_args={},
+                explicit_args={"showing": showing[i % len(showing)]},
+            )
+            latencies.append(await client.next_render(sent_at) - sent_at)
+            if args.rate:
+                await asyncio.sleep(1 / args.rate)
+        return latencies
+
+    bytes_before = sum(c.bytes_received for c in clients)
+    started_at = perf_counter()
+    latencies = sum(await asyncio.gather(*map(fire_events, clients)), [])
+    elapsed = perf_counter() - started_at
+    bytes_sent = sum(c.bytes_received for c in clients) - bytes_before
+    print(
+        f"events:    {len(latencies) / elapsed:>8.0f}/s  "
+        f"p50 {percentile(latencies, 50) * 1000:.1f}ms  "
+        f"p99 {percentile(latencies, 99) * 1000:.1f}ms  "
+        f"{bytes_sent / len(latencies):.0f} bytes/event"
+    )
+
+    fanouts = []
+    bytes_before = sum(c.bytes_received for c in clients)
+    items = [item async for item in Item.objects.all()]
+    for i in range(args.mutations):
+        item = items[i % len(items)]
+        item.completed = not item.completed
+        saved_at = perf_counter()
+        await item.asave()
+        arrived_at = await asyncio.gather(
+            *(c.next_render(saved_at) for c in clients)
+        )
+        fanouts.append(max(arrived_at) - saved_at)
+        if args.rate:
+            await asyncio.sleep(1 / args.rate)
+    bytes_sent = sum(c.bytes_received for c in clients) - bytes_before
+    if fanouts:
+        print(
+            f"mutations: {len(fanouts) / sum(fanouts):>8.0f}/s  "
+            f"p50 {percentile(fanouts, 50) * 1000:.1f}ms  "
+            f"p99 {percentile(fanouts, 99) * 1000:.1f}ms  "
+            f"{bytes_sent / len(fanouts) / len(clients):.0f} bytes/client"
+        )
+        print("the latency of a mutation is until every client got a render")
+
+    for client in clients:
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--items", type=int, default=20)
+    parser.add_argument("--events", type=int, default=20, help="per client")
+    parser.add_argument("--mutations", type=int, default=20)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="events per second of each client, 0 is as fast as possible",
+    )
+    parser.add_argument(
+        "--binary", action="store_true", help="use the binary subprotocol"
+    )
+    args = parser.parse_args()
+
+    setup(args.binary)
+    components = page_components(args.items)
+    asyncio.run(run(args, components))
+
+
+if __name__ == "__main__":
+    main()
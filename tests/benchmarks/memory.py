@@ -0,0 +1,81 @@
+"""Measures the memory held by the live components of the connections
+
+Each simulated connection joins `XTodoList` with its `XTodoItem` children in
+its own repository and renders them, like the consumer does, and the memory
+allocated in the meantime is divided by the amount of live components. With
+`--hibernated` the components are hibernated after rendering.
+
+Run it from the `tests` directory:
+
+    python -m benchmarks.memory --connections 100 --items 50
+"""
+
+import argparse
+import asyncio
+import gc
+import tracemalloc
+
+from .load import page_components, setup
+
+
+async def join(components: list[tuple[str, str, str]], hibernated: bool):
+    from reactor.repository import ComponentRepository
+    from reactor.state import adecode_states
+
+    states = await adecode_states([state for _, _, state in components])
+    (_, name, _), *children = components
+    repo = ComponentRepository(is_live=True, channel_name="memory")
+    root = await repo.join(
+        name,
+        states[0],
+        children={
+            id: (name, state)
+            for (id, name, _), state in zip(children, states[1:])
+        },
+    )
+    await root._render_diff(repo)
+    for component in list(repo.components.values()):
+        if component is not root:
+            await component._render_diff(repo)
+    if hibernated:
+        for id in list(repo.components):
+            repo.hibernate(id)
+    return repo
+
+
+async def run(args, components: list[tuple[str, str, str]]):
+    # the first connection fills the caches of the process
+    await join(components, args.hibernated)
+    gc.collect()
+    tracemalloc.start()
+    started_with = tracemalloc.get_traced_memory()[0]
+    repos = [
+        await join(components, args.hibernated) for _ in range(args.connections)
+    ]
+    gc.collect()
+    allocated = tracemalloc.get_traced_memory()[0] - started_with
+    tracemalloc.stop()
+
+    live = sum(len(repo.components) + len(repo.hibernated) for repo in repos)
+    print(
+        f"{args.connections} connections, {live} live components, "
+        f"{allocated / 1024 / 1024:.1f} MiB"
+    )
+    print(f"{allocated / live:.0f} bytes per live component")
+    print(f"{allocated / args.connections / 1024:.1f} KiB per connection")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--items", type=int, default=50)
+    parser.add_argument("--hibernated", action="store_true")
+    args = parser.parse_args()
+
+    setup(binary=False)
+    components = page_components(args.items)
+    asyncio.run(run(args, components))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Compares encoding models for `mutation` with Django's serializers
+
+Run it from the `tests` directory:
+
+    python -m benchmarks.serializer --number 10000
+"""
+
+import argparse
+import os
+import timeit
+
+import django
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=10000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fision.settings")
+    django.setup()
+    from django.core.serializers import deserialize, serialize
+    from django.utils import timezone
+
+    from fision.todo.models import Item
+    from reactor import codec, serializer
+
+    item = Item(text="task number 1", timestamp=timezone.now())
+
+    def django_encode():
+        return codec.dumps(
+            serialize("python", [item]),
+            default=serializer.ReactorJSONEncoder().default,
+        )
+
+    def django_decode(data):
+        return list(deserialize("python", codec.loads(data)))[0].object
+
+    encoders = {
+        "django serializers": (django_encode, django_decode),
+        "reactor serializer": (
+            lambda: serializer.encode(item),
+            serializer._decode,
+        ),
+        "update_fields": (
+            lambda: serializer.encode(item, {"text"}),
+            serializer._decode,
+        ),
+        # what the rest of the connections of the process pay
+        "cached decode": (
+            lambda: serializer.encode(item),
+            serializer.decode,
+        ),
+    }
+    print(f"{'encoder':<20}{'bytes':>8}{'encode':>12}{'decode':>12}")
+    for name, (encode, decode) in encoders.items():
+        data = encode()
+        encode_time = min(timeit.repeat(encode, number=args.number, repeat=3))
+        decode_time = min(
+            timeit.repeat(lambda: decode(data), number=args.number, repeat=3)
+        )
+        print(
+            f"{name:<20}{len(data):>8}"
+            f"{encode_time / args.number * 1e6:>9.1f} µs"
+            f"{decode_time / args.number * 1e6:>9.1f} µs"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -68,15 +68,17 @@ class XTodoList(Component):
 
 class XTodoCounter(Component):
     _template_name = "todo/counter.html"
+    _async_render = True
     _subscriptions = {"item"}
 
     @property
-    def items(self):
-        return Item.objects.all()
+    async def amount(self):
+        return await Item.objects.active().acount()
 
 
 class XTodoItem(Component):
     _template_name = "todo/item.html"
+    _async_render = True
 
     @property
     def _subscriptions(self):
@@ -1,14 +1,31 @@
 import asyncio
+import json
+import math
+from functools import cached_property
+from io import StringIO
 import threading
 from os import environ as env
 from random import randint
 from urllib.parse import urljoin
 from time import sleep
+from types import SimpleNamespace
+from unittest import mock
 
 from uvicorn.main import Server as Uvicorn
 from uvicorn.config import Config as UvicornConfig
 
-from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.contrib.auth.models import Group, Permission, User
+from django.core.management import call_command
+from django.core.serializers import serialize
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import QuerySet
+from django.template import engines
+from django.test import (
+    SimpleTestCase, TestCase, TransactionTestCase, Client, override_settings
+)
+from django.utils import timezone
+from channels.layers import InMemoryChannelLayer
 from channels.routing import get_default_application
 
 from selenium.webdriver.common.keys import Keys
@@ -22,6 +39,25 @@ from splinter.driver.webdriver.firefox import WebDriver as FirefoxDriver
 from splinter.driver.lxmldriver import LxmlDriver
 from splinter.driver.djangoclient import DjangoClient as DjangoDriver
 
+from reactor.codec import CODECS
+from reactor.component import (
+    SYNC_RENDERED, Component, ReactorMeta, dump_queryset, load_model_instances,
+    load_queryset,
+)
+from reactor.consumer import ReactorConsumer
+from reactor.diff import ENGINES, KeyedTree, TokenDictionary
+from reactor.fanout import LocalFanout
+from reactor.protocol import decode_renders, encode_renders
+from reactor.repository import ComponentRepository
+from reactor.slots import SlottedTemplate
+from reactor.utils import Handler
+from reactor import metrics, serializer, state
+from reactor.state import (
+    CacheStore, MemoryStore, StateExpired, adecode_states, decode_state,
+    encode_state,
+)
+
+from .live import XTodoCounter, XTodoList
 from .models import Item
 
 
@@ -38,6 +74,841 @@ class TestNormalRendering(TestCase):
         self.assertContains(response, 'First task')
         self.assertContains(response, 'Second task')
 
+    def test_properties_are_evaluated_once_per_render(self):
+        repo = ComponentRepository(is_live=False)
+        component = repo.build('XTodoList', {})
+        template = engines['django'].from_string(
+            '{% if items %}{% for item in items %}{{ item }},{% endfor %}'
+            '{{ items|length }}{% endif %}'
+        )
+        with self.assertNumQueries(1):
+            html = template.render(
+                component.reactor._get_context(component, repo, None)
+            )
+        self.assertEqual(html, 'First task,Second task,2')
+
+    def test_cond_expressions_can_use_variables_in_comprehensions(self):
+        repo = ComponentRepository(is_live=False)
+        component = repo.build('XTodoList', {})
+        template = engines['django'].from_string(
+            '{% load reactor %}'
+            '{% class {"some": any(i.text == text for i in items)} %}'
+        )
+        context = component.reactor._get_context(component, repo, None)
+        context['text'] = 'Second task'
+        with self.assertNumQueries(1):
+            html = template.render(context)
+        self.assertEqual(html, 'class="some"')
+
+
+# channels closes the connection of the thread, that holds the transaction of
+# the test
+@mock.patch('channels.db.close_old_connections', lambda: None)
+class TestAsyncRendering(TestCase):
+
+    def setUp(self):
+        Item.objects.create(text='First task')
+        Item.objects.create(text='Second task', completed=True)
+        self.addCleanup(SYNC_RENDERED.clear)
+
+    async def render(self, name):
+        repo = ComponentRepository(is_live=True)
+        component = repo.build(name, {})
+        payload = await component._render_diff(repo)
+        return ' '.join(payload['diff'])
+
+    async def test_async_properties_are_awaited_in_the_event_loop(self):
+        html = await self.render('XTodoCounter')
+        self.assertIn('<strong>1</strong> item left', html)
+        self.assertNotIn(XTodoCounter, SYNC_RENDERED)
+
+    async def test_sync_database_access_falls_back_to_a_thread(self):
+        with mock.patch.object(XTodoList, '_async_render', True):
+            with self.assertLogs('reactor', 'WARNING'):
+                html = await self.render('XTodoList')
+            self.assertIn('Second task', html)
+            self.assertIn(XTodoList, SYNC_RENDERED)
+            # from then on it is rendered in a thread without trying
+            with self.assertNoLogs('reactor', 'WARNING'):
+                await self.render('XTodoList')
+
+    def test_async_cached_properties_are_rejected(self):
+        with self.assertRaises(TypeError):
+            class Cached(Component, public=False):
+                @cached_property
+                async def amount(self):
+                    return 1
+
+
+QuerySetField = SimpleNamespace(type_=QuerySet)
+
+
+class TestModelLoading(TestCase):
+
+    def test_children_models_are_loaded_in_one_query(self):
+        items = [Item.objects.create(text=f'Task {i}') for i in range(3)]
+        states = [('XTodoItem', {'item': item.pk}) for item in items]
+        states.append(('XTodoItem', {'item': 404}))
+        with self.assertNumQueries(1):
+            load_model_instances(states)
+        self.assertEqual([s['item'] for _, s in states], items + [None])
+
+    def test_querysets_are_serialized_without_evaluating_them(self):
+        items = [Item.objects.create(text=f'Task {i}') for i in range(3)]
+        queryset = Item.objects.filter(text__gt='Task 0').order_by('-text')
+        with self.assertNumQueries(0):
+            state = dump_queryset(queryset[:1])
+            loaded = load_queryset(None, state, None, QuerySetField, None)
+        self.assertEqual(list(loaded), [items[2]])
+        self.assertEqual(json.loads(json.dumps(state)), state)
+
+    def test_querysets_with_joins_are_serialized_by_their_ids(self):
+        user = User.objects.create_user('user', password='secret')
+        group = Group.objects.create(name='group')
+        user.groups.add(group)
+        queryset = User.objects.filter(groups__user=user)
+        state = dump_queryset(queryset)
+        self.assertEqual(
+            state, {'app': 'auth', 'model': 'user', 'ids': [user.pk]}
+        )
+        loaded = load_queryset(None, state, None, QuerySetField, None)
+        self.assertEqual(list(loaded), [user])
+
+
+class TestBroadcastBuffer(TestCase):
+
+    def test_mutations_are_sent_together_when_the_transaction_commits(self):
+        sent = []
+
+        async def group_send_all(messages):
+            sent.extend(messages)
+
+        with mock.patch('reactor.utils._group_send_all', group_send_all):
+            with self.captureOnCommitCallbacks(execute=True):
+                item = Item.objects.create(text='First')
+                item.text = 'Second'
+                item.save()
+                item.save()
+                try:
+                    with transaction.atomic():
+                        Item.objects.create(text='Rolled back')
+                        raise ValueError
+                except ValueError:
+                    pass
+
+        mutations = {
+            channel: [
+                (mutation['action'], serializer.decode(mutation['instance']))
+                for mutation in message['mutations']
+            ]
+            for channel, message in sent
+        }
+        expected = [('CREATED', item), ('UPDATED', item)]
+        self.assertEqual(
+            mutations, {'item': expected, f'item.{item.pk}': expected}
+        )
+        self.assertEqual(mutations['item'][1][1].text, 'Second')
+
+    def test_nested_savepoints_keep_the_order_of_the_mutations(self):
+        sent = []
+
+        async def group_send_all(messages):
+            sent.extend(messages)
+
+        with mock.patch('reactor.utils._group_send_all', group_send_all):
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    item = Item.objects.create(text='v1')
+                    with transaction.atomic():
+                        item.text = 'v2'
+                        item.save()
+                    item.text = 'v3'
+                    item.save()
+                    try:
+                        with transaction.atomic():
+                            item.text = 'rolled back'
+                            item.save()
+                            Item.objects.create(text='rolled back')
+                            raise ValueError
+                    except ValueError:
+                        pass
+                    item.text = 'v4'
+                    item.save()
+
+        # a single message per channel
+        self.assertEqual(
+            [channel for channel, _ in sent], ['item', f'item.{item.pk}']
+        )
+        _, message = sent[0]
+        self.assertEqual(
+            [
+                (m['action'], serializer.decode(m['instance']).text)
+                for m in message['mutations']
+            ],
+            [('CREATED', 'v1'), ('UPDATED', 'v4')],
+        )
+
+
+class TestSerializer(SimpleTestCase):
+
+    def test_instances_survive_the_round_trip(self):
+        item = Item(text='Task', completed=True, timestamp=timezone.now())
+        decoded = serializer.decode(serializer.encode(item))
+        self.assertEqual(
+            (decoded.pk, decoded.text, decoded.completed, decoded.timestamp),
+            (item.pk, item.text, item.completed, item.timestamp),
+        )
+        self.assertFalse(decoded._state.adding)
+
+    def test_only_the_updated_fields_are_sent(self):
+        item = Item(text='Task', timestamp=timezone.now())
+        decoded = serializer.decode(serializer.encode(item, {'text'}))
+        self.assertEqual((decoded.pk, decoded.text), (item.pk, 'Task'))
+        self.assertEqual(
+            decoded.get_deferred_fields(), {'completed', 'timestamp'}
+        )
+
+    def test_updated_fields_can_be_attnames(self):
+        permission = Permission(
+            pk=1, name='Can do', codename='do', content_type_id=3
+        )
+        decoded = serializer.decode(
+            serializer.encode(permission, {'content_type_id'})
+        )
+        self.assertEqual(decoded.content_type_id, 3)
+        self.assertEqual(decoded.get_deferred_fields(), {'name', 'codename'})
+
+    def test_each_connection_gets_a_copy_of_the_decoded_instance(self):
+        data = serializer.encode(Item(text='Task', timestamp=timezone.now()))
+        with mock.patch(
+            'reactor.serializer._decode', wraps=serializer._decode
+        ) as decode:
+            first, second = serializer.decode(data), serializer.decode(data)
+        decode.assert_called_once_with(data)
+        self.assertIsNot(first, second)
+        first.text = 'Changed'
+        self.assertEqual(second.text, 'Task')
+
+    def test_copies_do_not_share_mutable_values(self):
+        item = Item(text='Task', timestamp=timezone.now())
+        item.text = {'tags': ['a']}  # like the value of a JSONField
+        with mock.patch('reactor.serializer._decode', return_value=item):
+            first = serializer.decode('{"mutable": 1}')
+            second = serializer.decode('{"mutable": 1}')
+        first.text['tags'].append('b')
+        self.assertEqual(second.text, {'tags': ['a']})
+        self.assertEqual(item.text, {'tags': ['a']})
+
+    def test_the_format_of_previous_versions_is_decoded(self):
+        item = Item(text='Task', timestamp=timezone.now())
+        decoded = serializer.decode(
+            json.dumps(serialize('python', [item]), cls=DjangoJSONEncoder)
+        )
+        self.assertEqual((decoded.pk, decoded.text), (item.pk, 'Task'))
+
+
+class TestMutationBatching(SimpleTestCase):
+
+    def test_mutations_in_the_window_are_delivered_together(self):
+        calls = []
+
+        class Component:
+            _name = 'Component'
+
+            async def mutations(self, channel, mutations):
+                calls.append((channel, mutations))
+
+        consumer = ReactorConsumer()
+        consumer.repo = mock.Mock()
+        consumer.repo.components_subscribed_to.return_value = [Component()]
+        consumer.send_render = mock.AsyncMock()
+        consumer.after_mutation_chores = mock.AsyncMock()
+
+        async def receive():
+            for text in ['First', 'Second', 'Third']:
+                await consumer.model_mutations({
+                    'channel': 'item',
+                    'mutations': [{
+                        'action': 'CREATED',
+                        'instance': serializer.encode(Item(text=text)),
+                    }],
+                })
+            self.assertEqual(calls, [])
+            await consumer.mutations_task
+
+        with mock.patch('reactor.settings.MUTATION_BATCH_WINDOW', 0.01):
+            asyncio.run(receive())
+
+        [(channel, mutations)] = calls
+        self.assertEqual(channel, 'item')
+        self.assertEqual(
+            [(m.action, m.instance.text) for m in mutations],
+            [('CREATED', 'First'), ('CREATED', 'Second'), ('CREATED', 'Third')],
+        )
+        consumer.send_render.assert_awaited_once()
+
+
+class TestRenderBatching(SimpleTestCase):
+
+    def setUp(self):
+        self.consumer = ReactorConsumer()
+        self.consumer.channel_layer = self.consumer.channel_name = None
+        self.consumer.repo = ComponentRepository(is_live=True)
+        self.consumer.tokens = TokenDictionary(0)
+        self.consumer.binary = False
+        self.consumer.base_send = mock.AsyncMock()
+
+    def component(self, id):
+        return SimpleNamespace(
+            id=id,
+            _name='Component',
+            reactor=ReactorMeta(params={}),
+            _render_diff=mock.AsyncMock(return_value={'diff': [id]}),
+        )
+
+    def sent(self):
+        calls = self.consumer.base_send.await_args_list
+        return [json.loads(call.args[0]['text']) for call in calls]
+
+    def test_renders_of_the_same_tick_are_sent_in_one_frame(self):
+        a, b = self.component('a'), self.component('b')
+
+        async def render():
+            for component in [a, b, a, a, b]:
+                await self.consumer.send_render(component)
+            await self.consumer.flush_task
+
+        asyncio.run(render())
+        self.assertEqual(
+            self.sent(),
+            [{
+                'command': 'render',
+                'payload': [
+                    {'id': 'a', 'diff': ['a']}, {'id': 'b', 'diff': ['b']}
+                ],
+            }],
+        )
+        a._render_diff.assert_awaited_once()
+        b._render_diff.assert_awaited_once()
+
+    def test_skipped_renders_are_not_sent(self):
+        a = self.component('a')
+        a.reactor.skip_render()
+
+        async def render():
+            await self.consumer.send_render(a)
+            self.assertIsNone(self.consumer.flush_task)
+            # the flag is consumed, the next one renders
+            await self.consumer.send_render(a)
+            await self.consumer.flush_task
+
+        asyncio.run(render())
+        self.assertEqual(len(self.sent()), 1)
+        a._render_diff.assert_awaited_once()
+
+    def test_commands_are_sent_after_the_pending_renders(self):
+        a = self.component('a')
+
+        async def render_and_focus():
+            await self.consumer.send_render(a)
+            flush_task = self.consumer.flush_task
+            await self.consumer.send_command('focus_on', {'selector': '#a'})
+            await flush_task
+
+        asyncio.run(render_and_focus())
+        self.assertEqual(
+            [message['command'] for message in self.sent()],
+            ['render', 'focus_on'],
+        )
+
+    @mock.patch('reactor.settings.METRICS', True)
+    def test_the_size_of_the_sent_renders_is_recorded(self):
+        sizes = []
+
+        def receiver(sender, metric, value, **kwargs):
+            if metric == 'payload':
+                sizes.append((sender, value))
+
+        metrics.metric_recorded.connect(receiver)
+        self.addCleanup(metrics.metric_recorded.disconnect, receiver)
+        a = self.component('a')
+
+        async def render():
+            for binary in [False, True]:
+                self.consumer.binary = binary
+                await self.consumer.send_render(a)
+                await self.consumer.flush_task
+
+        asyncio.run(render())
+        [text], [binary] = [
+            call.args for call in self.consumer.base_send.await_args_list
+        ]
+        render = '{"id": "a", "diff": ["a"]}'
+        self.assertIn(render, text['text'])
+        # the frame starts with its type and the amount of renders
+        self.assertEqual(
+            sizes,
+            [
+                ('Component', len(render)),
+                ('Component', len(binary['bytes']) - 2),
+            ],
+        )
+
+
+@mock.patch('reactor.settings.METRICS', True)
+class TestMetrics(SimpleTestCase):
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_measures_are_recorded_per_component(self):
+        received = []
+
+        def receiver(sender, metric, value, **kwargs):
+            received.append((sender, metric, value))
+
+        metrics.metric_recorded.connect(receiver)
+        self.addCleanup(metrics.metric_recorded.disconnect, receiver)
+        for value in [1, 2, 3, 100]:
+            metrics.record('XTodoList', 'render', value)
+        with metrics.timed('XTodoItem', 'event'):
+            pass
+
+        histograms = metrics.snapshot()
+        render = histograms['XTodoList', 'render']
+        self.assertEqual((render.count, render.max), (4, 100))
+        self.assertEqual(render.percentile(50), 4)  # 2 and 3 are in [2, 4)
+        self.assertEqual(render.percentile(99), 100)
+        self.assertEqual(histograms['XTodoItem', 'event'].count, 1)
+        self.assertEqual(len(received), 5)
+
+    def test_renders_over_the_budget_are_logged(self):
+        with mock.patch('reactor.settings.RENDER_BUDGET', 50):
+            with self.assertLogs('reactor', 'WARNING') as logs:
+                metrics.record('XTodoList', 'render', 10)
+                metrics.record('XTodoList', 'render', 80)
+        [message] = logs.output
+        self.assertIn('XTodoList took 80.0ms to render', message)
+
+    def test_the_command_shows_the_published_metrics(self):
+        metrics.record('XTodoList', 'render', 10)
+        metrics.publish()
+        out = StringIO()
+        call_command('reactor_metrics', stdout=out)
+        self.assertRegex(out.getvalue(), r'XTodoList +render +1 +10\.0')
+
+    def test_metrics_are_published_out_of_the_event_loop(self):
+        published_in = []
+
+        async def render():
+            metrics.record('XTodoList', 'render', 10)
+
+        with mock.patch.object(
+            metrics, 'publish',
+            lambda: published_in.append(threading.current_thread()),
+        ), mock.patch.object(metrics, '_published_at', -math.inf):
+            asyncio.run(render())
+            metrics._publisher.submit(lambda: None).result()
+        [thread] = published_in
+        self.assertIsNot(thread, threading.current_thread())
+
+
+class TestLocalFanout(SimpleTestCase):
+
+    def test_group_messages_reach_the_process_once(self):
+        layer = InMemoryChannelLayer()
+        fanout = LocalFanout(layer)
+        consumers = [mock.Mock(dispatch=mock.AsyncMock()) for _ in range(3)]
+        message = {'type': 'notification', 'channel': 'item', 'kwargs': {}}
+
+        async def broadcast():
+            for consumer in consumers:
+                await fanout.group_add('item', consumer)
+            await fanout.group_discard('item', consumers[2])
+            self.assertEqual(list(layer.groups['item']), [fanout.channel_name])
+            await layer.group_send('item', message)
+            await asyncio.sleep(0.01)
+            await fanout.discard(consumers[0])
+            await fanout.discard(consumers[1])
+            self.assertNotIn('item', layer.groups)
+            fanout.receiver.cancel()
+            fanout.refresher.cancel()
+
+        asyncio.run(broadcast())
+        consumers[0].dispatch.assert_awaited_once_with(message)
+        consumers[1].dispatch.assert_awaited_once_with(message)
+        consumers[2].dispatch.assert_not_awaited()
+        self.assertTrue(fanout.channel_name.startswith('reactor.fanout'))
+
+    def test_groups_are_added_again_before_they_expire(self):
+        layer = InMemoryChannelLayer(group_expiry=0.05)
+        fanout = LocalFanout(layer)
+        consumer = mock.Mock(dispatch=mock.AsyncMock())
+        message = {'type': 'notification', 'channel': 'item', 'kwargs': {}}
+
+        async def broadcast_later():
+            await fanout.group_add('item', consumer)
+            await asyncio.sleep(0.1)
+            await layer.group_send('item', message)
+            await asyncio.sleep(0.01)
+            fanout.receiver.cancel()
+            fanout.refresher.cancel()
+
+        asyncio.run(broadcast_later())
+        consumer.dispatch.assert_awaited_once_with(message)
+
+
+def apply_diff(last_html, diff):
+    # Same algorithm as `ReactorComponent.getHtml` in the front-end
+    html = []
+    cursor = 0
+    for fragment in diff:
+        if isinstance(fragment, str):
+            html.append(fragment)
+        elif fragment < 0:
+            cursor -= fragment
+        else:
+            html.extend(last_html[cursor:cursor + fragment])
+            cursor += fragment
+    return html
+
+
+class TestDiffEngines(SimpleTestCase):
+
+    cases = [
+        ('', '<div> a </div>'),
+        ('<div> a </div>', ''),
+        ('<div> a b c </div>', '<div> a b c </div>'),
+        ('<div> a b c </div>', '<div> a x c </div>'),
+        ('<div> a b c </div>', '<div> x a b y c z </div>'),
+        (
+            '<ul> <li>1</li> <li>2</li> <li>3</li> </ul>',
+            '<ul> <li>3</li> </ul>',
+        ),
+        ('<p> a b a b a </p>', '<p> b a b a b </p>'),
+    ]
+
+    def test_diffs_rebuild_the_new_html(self):
+        for name, engine in ENGINES.items():
+            for old, new in self.cases:
+                old, new = old.split(), new.split()
+                with self.subTest(engine=name, old=old, new=new):
+                    self.assertEqual(apply_diff(old, engine(old, new)), new)
+
+    def test_myers_only_sends_changed_tokens(self):
+        old = '<div> a b c d e </div>'.split()
+        new = '<div> a b x d e </div>'.split()
+        self.assertEqual(ENGINES['myers'](old, new), [3, -1, 'x', 3])
+
+    @mock.patch('reactor.diff.MAX_EDIT_DISTANCE', 2)
+    def test_myers_diffs_in_place_over_the_edit_distance(self):
+        old = '<ul> <li>a</li> <li>b</li> <li>c</li> </ul>'.split()
+        new = '<ul> <li>x</li> <li>b</li> <li>y</li> </ul> <p>z</p>'.split()
+        diff = ENGINES['myers'](old, new)
+        self.assertEqual(
+            diff, [1, -1, '<li>x</li>', 1, -1, '<li>y</li>', 1, '<p>z</p>']
+        )
+        self.assertEqual(apply_diff(old, diff), new)
+
+
+class TestRenderExecutor(SimpleTestCase):
+
+    def test_diffs_are_the_same_in_every_executor(self):
+        old, new = '<div> a b c d e </div>', '<div> a b x d e </div>'
+        for executor in [None, 'thread', 'process']:
+            with self.subTest(executor=executor):
+                meta = ReactorMeta(params={})
+
+                async def render_twice():
+                    await meta._tokens_diff(old, executor)
+                    return await meta._tokens_diff(new, executor)
+
+                self.assertEqual(
+                    asyncio.run(render_twice()), {'diff': [3, -1, 'x', 3]}
+                )
+                self.assertEqual(meta._last_sent_html, new)
+
+
+class TestTokenDictionary(SimpleTestCase):
+
+    def test_repeated_tokens_are_sent_by_index(self):
+        tokens = TokenDictionary(10)
+        row = ['<tr', 'class="pending">', '<td>task</td>', '</tr>']
+        encoded = [tokens.encode(row + [1]) for _ in range(3)]
+        self.assertEqual(encoded[0], row + [1])
+        self.assertEqual(
+            encoded[1],
+            ['<tr', ['class="pending">'], ['<td>task</td>'], '</tr>', 1]
+        )
+        self.assertEqual(encoded[2], ['<tr', [0], [1], '</tr>', 1])
+
+        # same as `ServerConnection.resolveTokens` in the front-end
+        dictionary = []
+        for diff in encoded:
+            resolved = []
+            for item in diff:
+                if isinstance(item, list):
+                    if isinstance(item[0], str):
+                        dictionary.append(item[0])
+                        item = item[0]
+                    else:
+                        item = dictionary[item[0]]
+                resolved.append(item)
+            self.assertEqual(resolved, row + [1])
+
+        frame = encode_renders([{'id': 'rx', 'diff': encoded[1]}])
+        self.assertEqual(decode_renders(frame)[0]['diff'], encoded[1])
+
+    def test_long_tokens_are_not_remembered(self):
+        tokens = TokenDictionary(10)
+        state = 'data-state="' + 'x' * 300 + '"'
+        encoded = [tokens.encode([state]) for _ in range(3)]
+        self.assertEqual(encoded, [[state]] * 3)
+        self.assertEqual(tokens.indexes, {})
+        self.assertEqual(len(tokens.seen), 0)
+
+
+class TestKeyedDiff(SimpleTestCase):
+
+    html = (
+        '<div id="x-list" data-state="1"><ul id="list">'
+        '<li data-key="1" class="a">One</li>'
+        '<li data-key="2" class="a">Two</li>'
+        '</ul></div>'
+    )
+
+    def diff(self, new_html):
+        return KeyedTree(new_html).diff(KeyedTree(self.html).hashes)
+
+    def test_first_render_sends_everything(self):
+        self.assertEqual(
+            KeyedTree(self.html).diff({}), ([((), self.html)], [])
+        )
+
+    def test_only_the_changed_row_is_sent(self):
+        patches, attributes = self.diff(self.html.replace('Two', 'Dos'))
+        path = ('[id="list"]', '[data-key="2"]')
+        self.assertEqual(
+            patches, [(path, '<li data-key="2" class="a">Dos</li>')]
+        )
+        self.assertEqual(attributes, [])
+
+    def test_removing_a_row_sends_the_parent(self):
+        patches, _ = self.diff(
+            self.html.replace('<li data-key="2" class="a">Two</li>', '')
+        )
+        self.assertEqual([path for path, _ in patches], [('[id="list"]',)])
+
+    def test_attribute_changes_only_send_the_start_tag(self):
+        patches, attributes = self.diff(
+            self.html.replace('data-state="1"', 'data-state="2"')
+        )
+        self.assertEqual(patches, [])
+        self.assertEqual(
+            attributes, [((), '<div id="x-list" data-state="2">')]
+        )
+
+    def test_keys_can_repeat_in_nested_lists(self):
+        html = (
+            '<div id="x-list">'
+            '<section data-key="1"><p data-key="2">A</p></section>'
+            '<section data-key="2"><p data-key="1">B</p></section>'
+            '</div>'
+        )
+        previous = KeyedTree(html).hashes
+        patches, _ = KeyedTree(html.replace('B', 'C')).diff(previous)
+        self.assertEqual(
+            patches,
+            [(('[data-key="2"]', '[data-key="1"]'), '<p data-key="1">C</p>')],
+        )
+        patches, _ = KeyedTree(
+            html.replace('<p data-key="1">B</p>', '')
+        ).diff(previous)
+        self.assertEqual(
+            patches, [(('[data-key="2"]',), '<section data-key="2"></section>')]
+        )
+
+
+class TestEventHandlers(SimpleTestCase):
+
+    def test_handlers_are_introspected_once(self):
+        handler = XTodoList._handlers['add']
+        self.assertEqual(handler, Handler(False, frozenset({'new_item'})))
+        self.assertEqual(
+            handler.filter({'new_item': 'Task', 'toggle_all': True}),
+            {'new_item': 'Task'},
+        )
+        self.assertIn('toggle_all', XTodoList._handlers)
+
+
+class TestBinaryProtocol(SimpleTestCase):
+
+    def test_renders_survive_the_round_trip(self):
+        renders = [
+            {'id': 'rx-1', 'diff': [300, -2, 'héllo <b>', 5_000_000]},
+            {'id': 'rx-2', 'slots': {'1': 'done'}},
+        ]
+        frame = encode_renders(renders)
+        self.assertEqual(decode_renders(frame), renders)
+        self.assertLess(len(frame), len(json.dumps(renders)))
+
+
+class TestCodecs(SimpleTestCase):
+
+    def test_dates_go_through_the_default_of_every_codec(self):
+        def default(value):
+            return 'custom'
+
+        for name, codec in CODECS.items():
+            with self.subTest(codec=name):
+                data = codec.dumps({'at': timezone.now()}, default)
+                self.assertEqual(codec.loads(data), {'at': 'custom'})
+
+
+class TestSubscriptionIndex(SimpleTestCase):
+
+    def register(self, repo, id, subscriptions):
+        component = SimpleNamespace(id=id, _subscriptions=subscriptions)
+        return repo.register_component(component)
+
+    def test_only_first_and_last_subscribers_change_the_channels(self):
+        repo = ComponentRepository(is_live=True)
+        a = self.register(repo, 'a', {'item', 'item.1'})
+        self.register(repo, 'b', {'item'})
+        self.assertEqual(
+            repo.pop_subscription_changes(), ({'item', 'item.1'}, set())
+        )
+        self.assertEqual(
+            [c.id for c in repo.components_subscribed_to('item.1')], ['a']
+        )
+
+        a._subscriptions = {'item', 'item.2'}
+        repo.refresh_subscriptions(a)
+        repo.remove('b')
+        self.assertEqual(
+            repo.pop_subscription_changes(), ({'item.2'}, {'item.1'})
+        )
+        self.assertEqual(repo.subscriptions, {'item', 'item.2'})
+
+        # subscribing and unsubscribing in between cancel each other
+        repo.remove('a')
+        self.register(repo, 'c', {'item'})
+        self.assertEqual(
+            repo.pop_subscription_changes(), (set(), {'item.2'})
+        )
+
+
+class TestHibernation(SimpleTestCase):
+
+    def test_idle_components_hibernate_and_wake_up(self):
+        repo = ComponentRepository(is_live=True)
+        todo_list = repo.build('XTodoList', {'id': 'list'})
+        todo_list.reactor._last_sent_html = '<ul> </ul>'
+
+        async def hibernate_and_wake():
+            await repo.dispatch_event('list', 'show', [], {'showing': 'active'})
+            with mock.patch('reactor.settings.HIBERNATE_AFTER', 60):
+                repo.hibernate_idle()
+                self.assertEqual(repo.components, {'list': todo_list})
+                repo.active_at['list'] -= 61
+                repo.hibernate_idle(keep={'list'})
+                self.assertEqual(repo.components, {'list': todo_list})
+                repo.hibernate_idle()
+            self.assertEqual(repo.components, {})
+            # still gets the mutations of its channels
+            self.assertEqual(repo.subscriptions, {'item'})
+            await repo.wake_subscribed_to('item')
+
+        asyncio.run(hibernate_and_wake())
+        woken = repo.get('list')
+        self.assertIsNot(woken, todo_list)
+        self.assertEqual(woken.showing, 'active')
+        # the next render is sent whole
+        self.assertEqual(woken.reactor._last_sent_html, '')
+        self.assertEqual(repo.hibernated, {})
+
+    def test_send_render_wakes_the_component_up(self):
+        consumer = ReactorConsumer()
+        consumer.repo = ComponentRepository(is_live=True)
+        consumer.repo.build('XTodoList', {'id': 'list', 'showing': 'active'})
+        consumer.repo.hibernate('list')
+        consumer.send_render = mock.AsyncMock()
+
+        asyncio.run(consumer.component_send_render('list'))
+        [(component,), _] = consumer.send_render.await_args
+        self.assertEqual(component.showing, 'active')
+        self.assertEqual(consumer.repo.hibernated, {})
+
+
+class TestStateEncoding(SimpleTestCase):
+
+    def component(self, compress, id='x'):
+        state = {'id': id, 'ids': list(range(200))}
+        return SimpleNamespace(
+            json=lambda exclude: json.dumps(state),
+            _exclude_fields=set(),
+            _compress_state=compress,
+        )
+
+    def test_compressed_state_is_shorter_and_decodes(self):
+        plain = encode_state(self.component(False))
+        compressed = encode_state(self.component(True))
+        self.assertLess(len(compressed), len(plain))
+        self.assertEqual(decode_state(compressed), decode_state(plain))
+        self.assertEqual(decode_state(plain)['ids'][-1], 199)
+
+    def test_stored_states_only_send_the_key(self):
+        with mock.patch.object(state, 'store', MemoryStore(1)):
+            first = encode_state(self.component(True, id='first'))
+            second = encode_state(self.component(True, id='second'))
+            self.assertLess(len(second), 100)
+            [decoded] = asyncio.run(adecode_states([second]))
+            self.assertEqual(decoded['id'], 'second')
+            # evicted by the second one
+            with self.assertRaises(StateExpired):
+                asyncio.run(adecode_states([first, second]))
+
+    def test_the_cache_store_does_not_block_the_event_loop(self):
+        store = CacheStore('default')
+        store.cache = mock.Mock(
+            aset=mock.AsyncMock(), aget_many=mock.AsyncMock(return_value={})
+        )
+        store.set('rendered-in-a-thread', 'state')
+        store.cache.set.assert_called_once_with(
+            'rendered-in-a-thread', 'state', 86_400
+        )
+
+        async def render_and_join():
+            store.set('rendered-in-the-loop', 'state')
+            found = await store.aget_many(['rendered-in-the-loop'])
+            await asyncio.gather(*store.tasks)
+            return found
+
+        found = asyncio.run(render_and_join())
+        self.assertEqual(found, {'rendered-in-the-loop': 'state'})
+        store.cache.aset.assert_awaited_once_with(
+            'rendered-in-the-loop', 'state', 86_400
+        )
+        self.assertEqual(store.pending, {})
+
+
+class TestSlottedTemplate(SimpleTestCase):
+
+    def test_only_tags_and_variables_are_slots(self):
+        template = SlottedTemplate(engines['django'].from_string(
+            '{% load reactor %}\n'
+            '<div {% class {"done": done} %}>\n'
+            '  <span>{{ text }}</span>\n'
+            '</div>\n'
+        ))
+        self.assertEqual(
+            template.statics, ['<div ', '>\n  <span>', '</span>\n</div>']
+        )
+        self.assertEqual(
+            template.render({'done': True, 'text': '<b>'}),
+            ['class="done"', '&lt;b&gt;'],
+        )
+
 
 # HACK: https://github.com/cobrateam/splinter/pull/820
 